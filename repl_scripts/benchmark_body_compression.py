@@ -0,0 +1,40 @@
+# Compares storing the entry bodies of a resource as JSON and compressed (compressBody in
+# the resource config). Prints the total size of the bodies in each format and the time
+# it takes to read and decode all the latest versions. The database is not changed.
+#
+# Usage: karp-cli repl repl_scripts/benchmark_body_compression.py <resource_id>
+
+import json
+import sys
+import time
+
+from karp.lex.infrastructure.sql import models, resource_repository
+
+resource_id = sys.argv[1]
+
+entries = resource_repository.entries_by_resource_id(resource_id)
+bodies = [entry.body for entry in entries.all_entries(fetch_size=1000)]
+
+json_size = sum(len(json.dumps(body, ensure_ascii=False).encode("utf-8")) for body in bodies)
+compressed = [models.compress_body(body) for body in bodies]
+compressed_size = sum(len(data) for data in compressed)
+print(f"{len(bodies)} entries")
+print(f"json: {json_size / 1024:.0f} KiB")
+print(f"compressed: {compressed_size / 1024:.0f} KiB ({compressed_size / max(json_size, 1):.0%})")
+
+before = time.perf_counter()
+for _ in entries.all_entries(fetch_size=1000):
+    pass
+scan = time.perf_counter() - before
+print(f"scan with current storage (compress_body={entries.config.compress_body}): {scan:.2f}s")
+
+serialized = [json.dumps(body, ensure_ascii=False) for body in bodies]
+before = time.perf_counter()
+for data in serialized:
+    json.loads(data)
+json_decode = time.perf_counter() - before
+before = time.perf_counter()
+for data in compressed:
+    models.decompress_body(data)
+compressed_decode = time.perf_counter() - before
+print(f"decode json: {json_decode:.2f}s, decode compressed: {compressed_decode:.2f}s")
@@ -0,0 +1,39 @@
+# Measures the time spent parsing queries per request, without and with the parse cache
+# (search_service.parse_query). The queries are sent the given number of times in random
+# order, like repeated requests from a frontend. Nothing is sent to OpenSearch.
+#
+# Usage: karp-cli repl repl_scripts/benchmark_query_parse.py [number of requests]
+
+import random
+import sys
+import time
+
+from karp.search.infrastructure.opensearch.search_service import parse_query, parser
+
+no_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+queries = [
+    "equals|baseform|katt",
+    "startswith|baseform|kat",
+    "freetext|hund",
+    "and(equals|pos|nn||startswith|baseform|a)",
+    "or(equals|baseform|katt||equals|baseform|hund||equals|baseform|häst)",
+    "not(exists|inflectiontable)",
+    'and(freetext|"röd katt"||not(equals|pos|vb))',
+    "inflectiontable(and(equals|msd|sg indef nom||startswith|wf|katt))",
+    "gt|_last_modified|1700000000",
+    "regexp|baseform|.*ning",
+]
+# seeded, so that runs can be compared
+requests = random.Random(0).choices(queries, k=no_requests)  # noqa: S311
+
+for name, parse in [("uncached", parser.parse), ("cached", parse_query)]:
+    parse_query.cache_clear()
+    before = time.perf_counter()
+    for q in requests:
+        parse(q)
+    elapsed = time.perf_counter() - before
+    print(f"{name}: {no_requests} requests in {elapsed:.2f}s, {elapsed / no_requests * 1e6:.1f} µs/request")
+
+info = parse_query.cache_info()
+print(f"cache hits: {info.hits}, misses: {info.misses}")
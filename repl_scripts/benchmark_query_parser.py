@@ -0,0 +1,38 @@
+# Measures the time it takes to parse queries with the parser generated by TatSu and with the
+# hand-written one (see QUERY_PARSER in karp.main.config). The parse cache is not used.
+#
+# Usage: karp-cli repl repl_scripts/benchmark_query_parser.py [number of repetitions]
+
+import sys
+import time
+
+from karp.search.domain.query_dsl.karp_query_fast_parser import KarpQueryFastParser
+from karp.search.domain.query_dsl.karp_query_model import KarpQueryModelBuilderSemantics
+from karp.search.domain.query_dsl.karp_query_parser import KarpQueryParser
+
+repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+queries = [
+    "equals|baseform|katt",
+    "freetext|hund",
+    "gt|_last_modified|1700000000",
+    "and(equals|pos|nn||startswith|baseform|a)",
+    "or(equals|baseform|katt||equals|baseform|hund||equals|baseform|häst)",
+    'and(freetext|"röd katt"||not(equals|pos|vb||exists|inflectiontable))',
+    "inflectiontable(and(equals|msd|sg indef nom||startswith|wf|katt))",
+    "and(" + "||".join(f"equals|baseform|word{i}" for i in range(50)) + ")",
+]
+
+parsers = [
+    ("tatsu", KarpQueryParser(semantics=KarpQueryModelBuilderSemantics())),
+    ("fast", KarpQueryFastParser()),
+]
+
+for q in queries:
+    print(q if len(q) < 80 else q[:77] + "...")
+    for name, parser in parsers:
+        before = time.perf_counter()
+        for _ in range(repetitions):
+            parser.parse(q)
+        elapsed = time.perf_counter() - before
+        print(f"  {name}: {elapsed / repetitions * 1e6:.1f} µs/query")
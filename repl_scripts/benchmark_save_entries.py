@@ -0,0 +1,56 @@
+# Compares inserting entries one by one (EntryRepository.save) with bulk inserts
+# (EntryRepository.save_all) and prints rows/second for each. Runs against the
+# database in DATABASE_URL, so run it once with SQLite and once with MariaDB.
+# Nothing is committed, all inserted rows are rolled back.
+#
+# Usage: karp-cli repl repl_scripts/benchmark_save_entries.py <resource_id> [number of entries] [chunk size]
+
+import sys
+import time
+
+from karp.foundation.value_objects import unique_id
+from karp.globals import session
+from karp.lex.domain.entities.entry import create_entry
+from karp.lex.infrastructure.sql import resource_repository
+
+resource_id = sys.argv[1]
+no_entries = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+chunk_size = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+
+entries = resource_repository.entries_by_resource_id(resource_id)
+dialect = session.get_bind().dialect.name
+
+
+def make_entries():
+    # the entries are not validated against the resource config, only the DB is measured
+    return [
+        create_entry(
+            {"benchmark": i, "text": "lorem ipsum " * 20},
+            id=unique_id.make_unique_id(),
+            resource_id=resource_id,
+            last_modified_by="benchmark",
+            message="benchmark",
+        )
+        for i in range(no_entries)
+    ]
+
+
+def one_by_one(batch):
+    for entry in batch:
+        entries.save(entry)
+    session.flush()
+
+
+def bulk(batch):
+    entries.save_all(batch)
+    session.flush()
+
+
+for name, save in [("save", one_by_one), ("save_all", bulk)]:
+    batch = make_entries()
+    before = time.perf_counter()
+    for i in range(0, len(batch), chunk_size):
+        save(batch[i : i + chunk_size])
+    elapsed = time.perf_counter() - before
+    session.rollback()
+    print(f"{dialect} {name}: {no_entries} entries in {elapsed:.2f}s, {no_entries / elapsed:.0f} rows/s")
@@ -1,29 +1,36 @@
 # Does a search and replace on all text fields in a resource.
 
+import copy
 import sys
 
 from karp.foundation import json
+from karp.foundation.value_objects import UniqueId
 
 entry_commands.start_transaction()
 
 resource_name = sys.argv[1]
 
+replacements = {}
 for line in sys.stdin.readlines():
     id, search, replace = line.split()
+    replacements.setdefault(UniqueId.validate(id), []).append((search, replace))
 
-    entry = entry_queries.by_id(resource_name, id)
+for entry in entry_commands.prefetch_entries(resource_name, replacements.keys()):
     print(entry.id)
 
-    for path in json.all_paths(entry.entry):
-        value = json.get_path(path, entry.entry)
+    # the prefetched entry is the one that update_entry changes, so edit a copy of the body
+    body = copy.deepcopy(entry.body)
+    for search, replace in replacements[entry.id]:
+        for path in json.all_paths(body):
+            value = json.get_path(path, body)
 
-        if isinstance(value, str):
-            new_value = value.replace(search, replace)
+            if isinstance(value, str):
+                new_value = value.replace(search, replace)
 
-            if value != new_value:
-                print(value, "=>", new_value)
-                json.set_path(path, new_value, entry.entry)
+                if value != new_value:
+                    print(value, "=>", new_value)
+                    json.set_path(path, new_value, body)
 
-    entry_commands.update_entry(resource_name, entry.id, entry.version, "", "", entry.entry)
+    entry_commands.update_entry(resource_name, entry.id, entry.version, "", "", body)
 
 entry_commands.commit()
@@ -63,6 +63,11 @@ def get_history(
     from_version: Optional[int] = Query(None),
     current_page: int = Query(0),
     page_size: int = Query(100),
+    cursor: Optional[str] = Query(
+        None,
+        description="Use `nextCursor` from a previous response to get the next page, instead of `current_page`.",
+    ),
+    include_total: bool = Query(True, description="If false, `total` is not computed, which makes paging faster."),
 ):
     if not resource_permissions.has_permission(auth.PermissionLevel.write, user, [resource_id]):
         raise HTTPException(
@@ -79,5 +84,7 @@ def get_history(
         entryId=entry_id,
         fromVersion=from_version,
         toVersion=to_version,
+        cursor=cursor,
+        includeTotal=include_total,
     )
     return entry_queries.get_history(history_request)
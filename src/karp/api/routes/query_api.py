@@ -1,11 +1,18 @@
-import logging  # noqa: I001
+import itertools  # noqa: I001
+import json
+import logging
 from typing import Optional
 
+import anyio
 from fastapi import APIRouter, Depends, HTTPException, Path, Query, status
+from starlette import responses
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 
 from karp import auth
 from karp.api import dependencies as deps
 from karp.auth.application import resource_permission_queries as resource_permissions
+from karp.foundation.pipeline import run_pipeline
+from karp.globals import new_session
 from karp.lex.application import search_queries
 from karp.lex.domain.errors import ResourceNotFound
 from karp.lex.infrastructure.sql import resource_repository
@@ -113,12 +120,31 @@ def query(
         For example, to fetch only the field `baseform` in the entry, use: `?path=entry.baseform`
         If the selected field is an array, the result will also be wrapped in an array.""",
     ),
+    fields: Optional[str] = Query(
+        None,
+        description="""A comma-separated list of dot-separated paths, only these fields of each hit are returned.
+        For example, `?fields=id,entry.baseform,entry.pos` gives hits with only `id` and the fields `baseform` and `pos`
+        of the entry. Can be combined with `path`.""",
+    ),
     highlight: HighlightParam = Query(
         HighlightParam.false,
         description="""Adds which fields the query matched and a small hit context with `<em>` wrapped around the match.
                         For compatibility reasons the values are true/new/false. true gives an older version of the highlight and
                         new gives the future format, which includes indices for lists.""",
     ),
+    cursor: Optional[str] = Query(
+        None,
+        description="""For paging through many hits. Use `cursor=*` to get the first page, the response then
+        contains a `cursor` that is given to get the next page (with the same `q` and `sort`). When there are no
+        more hits, `cursor` is null. `from` is ignored. A cursor is valid for a few minutes after the last request.""",
+    ),
+    output_format: str = Query(
+        "json",
+        alias="format",
+        pattern="^(json|ndjson)$",
+        description="""With `ndjson`, the hits are streamed as they are found, one JSON object per line, without
+        `total` and `distribution`. Then `size` may be larger than 10000, for downloading large results.""",
+    ),
     user: auth.User = Depends(deps.get_user_optional),
 ):
     """
@@ -145,9 +171,56 @@ def query(
         size=size,
         sort=sort,
         path=path,
+        fields=fields.split(",") if fields else [],
         lexicon_stats=lexicon_stats,
         highlight=highlight,
+        cursor=cursor,
     )
     logger.debug(f"{search_queries=}")
+    if output_format == "ndjson":
+        return _ndjson_response(query_request)
     response = search_queries.query(query_request)
     return response
+
+
+def _ndjson_response(query_request: QueryRequest) -> responses.StreamingResponse:
+    """
+    Stream the hits for query_request, one per line. The hits are fetched and expanded in one
+    thread and serialized in another, while the response is sent.
+    """
+
+    def search():
+        # the session of the request is closed before the response has been sent
+        with new_session():
+            yield from search_queries.stream(query_request)
+
+    def serialize(hits):
+        for hit in hits:
+            yield json.dumps(hit, ensure_ascii=False) + "\n"
+
+    lines = run_pipeline(("search", search), ("serialize", serialize))
+    # wait for the first hit, so that an error in the query gives an error response
+    first = list(itertools.islice(lines, 1))
+
+    async def content():
+        try:
+            async for line in iterate_in_threadpool(itertools.chain(first, lines)):
+                yield line
+        finally:
+            # stop the threads, which closes the database session and the point in time, also if
+            # the client has disconnected and the response is cancelled
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(lines.close)
+
+    return _ClosingStreamingResponse(content(), media_type="application/x-ndjson")
+
+
+class _ClosingStreamingResponse(responses.StreamingResponse):
+    """A streaming response that closes its content when it ends, not when it is garbage collected."""
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.body_iterator.aclose()
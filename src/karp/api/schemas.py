@@ -55,6 +55,8 @@ class QueryResponse(pydantic.BaseModel):
     total: int
     hits: list[Union[EntryDto, object]]
     distribution: Optional[Dict[str, int]]
+    # only when paging with a cursor, None on the last page
+    cursor: Optional[str] = None
 
 
 class QueryStatsResponse(pydantic.BaseModel):
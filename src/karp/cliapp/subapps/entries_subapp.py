@@ -18,6 +18,11 @@ chunked_option = typer.Option(False, help="use to avoid loading the whole file i
 chunk_size_option = typer.Option(1000, help="Number of entries per chunk (only if `--chunked`)")
 user_option = typer.Option(None, help="Username for edit in history", show_default=False)
 message_option = typer.Option(None, help="Message for edit in history", show_default=False)
+wait_for_index_option = typer.Option(
+    True,
+    help="Update the search index before returning, otherwise use `karp-cli entries index-outbox` later "
+    "or have `karp-cli entries index-worker` running",
+)
 
 
 @subapp.command("add")
@@ -31,6 +36,7 @@ def add_entries_to_resource(
     chunk_size: int = chunk_size_option,
     user: Optional[str] = user_option,
     message: Optional[str] = message_option,
+    wait_for_index: bool = wait_for_index_option,
 ):
     """
     Adds new entries from a JSONL file to Karp
@@ -46,7 +52,7 @@ def add_entries_to_resource(
     from karp.entry_commands import EntryCommands
     from karp.foundation.value_objects import unique_id
 
-    entry_commands = EntryCommands()
+    entry_commands = EntryCommands(wait_for_index=wait_for_index)
     user = user or "local admin"
     message = message or "imported through cli"
     entries = json_arrays.load_from_file(data)
@@ -80,6 +86,7 @@ def import_entries_to_resource(
     chunk_size: int = chunk_size_option,
     user: Optional[str] = user_option,
     message: Optional[str] = message_option,
+    wait_for_index: bool = wait_for_index_option,
 ):
     """
     Import entries from a JSONL file with entries and metadata (id, last_modified_by, message etc.)
@@ -98,7 +105,7 @@ def import_entries_to_resource(
 
     from karp.entry_commands import EntryCommands
 
-    entry_commands = EntryCommands()
+    entry_commands = EntryCommands(wait_for_index=wait_for_index)
     user = user or "local admin"
     message = message or "imported through cli"
     entries = json_arrays.load_from_file(data)
@@ -131,6 +138,7 @@ def export_entries(
     ),
     expand_plugins: bool = typer.Option(True, help="includes/exludes fields populated by plugins"),
     entry_only: bool = typer.Option(False, help="omits/includes history information about each entry"),
+    fetch_size: int = typer.Option(1000, help="Number of entries to fetch from the database at a time"),
 ):
     """
     Export all entries in a resource (latest versions)
@@ -145,7 +153,7 @@ def export_entries(
 
     from karp.lex.application import entry_queries
 
-    entries = entry_queries.all_entries(resource_id=resource_id, expand_plugins=expand_plugins)
+    entries = entry_queries.all_entries(resource_id=resource_id, fetch_size=fetch_size, expand_plugins=expand_plugins)
     logger.debug(
         "exporting entries",
         extra={"resource_id": resource_id, "type(all_entries)": type(entries)},
@@ -167,6 +175,7 @@ def export_entries(
 def batch_entries(
     ctx: typer.Context,
     data: Path = data_option,
+    wait_for_index: bool = wait_for_index_option,
 ):
     """Run entry commands in batch.
 
@@ -182,15 +191,27 @@ def batch_entries(
 
     `{"cmdtype": "add_entry","resource_id": "resource_a","entry": {"baseform": "sko"},"message": "add sko","user": "alice@example.com"}`
     """
+    from collections import defaultdict
+
     import json_arrays
 
     from karp.entry_commands import EntryCommands
     from karp.foundation.value_objects import unique_id
 
     logger.info("run entries command in batch")
-    entry_commands = EntryCommands()
+    entry_commands = EntryCommands(wait_for_index=wait_for_index)
     entry_commands.start_transaction()
-    for cmd in json_arrays.load_from_file(data):
+    cmds = list(json_arrays.load_from_file(data))
+
+    # fetch the entries that will be updated or deleted with a few queries instead of one per command
+    ids_by_resource = defaultdict(list)
+    for cmd in cmds:
+        if cmd["cmdtype"] in ("update_entry", "delete_entry"):
+            ids_by_resource[cmd["resource_id"]].append(cmd.get("_id") or cmd["id"])
+    for resource_id, ids in ids_by_resource.items():
+        entry_commands.prefetch_entries(resource_id, ids)
+
+    for cmd in cmds:
         command_type = cmd["cmdtype"]
         del cmd["cmdtype"]
         if "id" in cmd and command_type != "add_entry":
@@ -206,6 +227,54 @@ def batch_entries(
     entry_commands.commit()
 
 
+@subapp.command("index-outbox")
+@cli_error_handler
+@cli_timer
+def index_outbox(
+    ctx: typer.Context,
+    batch_size: int = typer.Option(1000, help="Number of changed entries to index at a time"),
+):
+    """
+    Update the search index with the changes in the index outbox
+
+    - the outbox contains changes that are not yet in the index, because they were made with `--no-wait-for-index`
+      or because the indexing failed
+
+    - to keep the index up to date continuously, use `karp-cli entries index-worker`
+    """
+    from karp import search_commands
+
+    count = 0
+    while handled := search_commands.apply_index_outbox(batch_size=batch_size):
+        count += handled
+    typer.echo(f"Successfully indexed {count} changes")
+
+
+@subapp.command("index-worker")
+@cli_error_handler
+def index_worker(
+    ctx: typer.Context,
+    batch_size: int = typer.Option(5000, help="Maximum number of changed entries to index at a time"),
+    poll_interval: float = typer.Option(1.0, help="Seconds to wait before looking for new changes"),
+):
+    """
+    Run a worker that keeps the search index up to date with the changes in the index outbox
+
+    - use together with WAIT_FOR_INDEX=false for the API, to move indexing out of the requests
+
+    - repeated edits of the same entry are only indexed once, and the changes of all resources are sent
+      to the index in one request per batch
+
+    - runs until interrupted
+    """
+    from karp import search_commands
+
+    try:
+        search_commands.run_index_worker(batch_size=batch_size, poll_interval=poll_interval)
+    except KeyboardInterrupt:
+        typer.echo("Index worker stopped")
+
+
 @subapp.command("validate")
 @cli_error_handler
 @cli_timer
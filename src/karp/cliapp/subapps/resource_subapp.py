@@ -34,6 +34,9 @@ config_option = typer.Argument(help="A path to a resource config file", show_def
 resource_option = typer.Argument(help="The ID of an existing resource", show_default=False)
 version_option = typer.Argument(None, help="The version to do this operation on")
 remove_old_index_option = typer.Option(False, help="If set, will remove the old index when the new one is completed.")
+fetch_size_option = typer.Option(1000, help="Number of entries to fetch from the database at a time")
+processes_option = typer.Option(1, help="Number of worker processes that expand and index entries in parallel")
+restart_option = typer.Option(False, help="Delete an interrupted reindex and start over")
 
 
 def _reload_backend():
@@ -154,7 +157,13 @@ def publish(ctx: typer.Context, resource_id: str = resource_option, version: Opt
 @cli_error_handler
 @cli_timer
 def reindex(
-    ctx: typer.Context, resource_id: str = resource_option, remove_old_index: Optional[bool] = remove_old_index_option
+    ctx: typer.Context,
+    resource_id: str = resource_option,
+    remove_old_index: Optional[bool] = remove_old_index_option,
+    fetch_size: int = fetch_size_option,
+    resume: bool = typer.Option(False, help="Continue an interrupted reindex from its last checkpoint"),
+    restart: bool = restart_option,
+    processes: int = processes_option,
 ):
     """
     Recreate the search index for a resource
@@ -163,24 +172,68 @@ def reindex(
 
     - If remove-old-index, deletes the old index after reindexing, default is to keep the old index (--no-remove-old-index)
 
-    - Will first fetch all entries and reindex. Then fetch entries that are edited since last fetch. Do this in a loop until no new changes are seen.
-      There is a very small risk that something will be edited in the short time during which the index alias is being pointed to new new index.
+    - Edits made while the reindex is running are written both to the current index and to the new index, so the new index is
+      up to date when the index alias is pointed to it
+
+    - Progress is saved every fetch-size entries. If the reindex is interrupted, use --resume to continue into the same new index.
+      A new reindex of the resource cannot be started until then, unless --restart is used, which deletes the interrupted
+      reindex first
+
+    - With --processes N, the entries are split into N partitions by id that are indexed in parallel
+
+    - Reading, plugin expansion and indexing run concurrently, the throughput of each stage is printed at the end
     """
     from karp import search_commands
 
-    count, gen = search_commands.reindex_resource(resource_id=resource_id, remove_old_index=remove_old_index)
+    start = 0
+    if resume and (checkpoint := search_commands.get_reindex_checkpoint(resource_id)):
+        start = checkpoint.indexed
+        typer.echo(f"Resuming reindex into {checkpoint.index_name}, {start} entries are already indexed")
+
+    stats = []
+    count, gen = search_commands.reindex_resource(
+        resource_id=resource_id,
+        remove_old_index=remove_old_index,
+        fetch_size=fetch_size,
+        resume=resume,
+        processes=processes,
+        stats=stats,
+        restart=restart,
+    )
 
     # a progress bar that renders poorly, but better than nothing
     with typer.progressbar(length=count, label="Indexing progress", show_eta=False) as progress:
-        for i, _ in enumerate(gen):
+        progress.update(start)
+        for i, _ in enumerate(gen, start=start):
             progress.update(1)
             progress.label = f"Indexing progress ({i} / {count})"
     typer.echo(f"Successfully reindexed all data in {resource_id}")
+    for stage in stats:
+        typer.echo(f"  {stage}")
 
     # reload backend to make sure that backend sees changes to index
     _reload_backend()
 
 
+@subapp.command()
+@cli_error_handler
+def abort_reindex(
+    ctx: typer.Context,
+    resource_id: str = resource_option,
+):
+    """
+    Deletes an interrupted reindex of the resource: its checkpoint and the partially filled new index
+
+    - Edits are then no longer written to the new index, and a new reindex can be started
+    """
+    from karp import search_commands
+
+    if search_commands.abort_reindex(resource_id):
+        typer.echo(f"Removed the interrupted reindex of {resource_id}")
+    else:
+        typer.echo(f"There is no interrupted reindex of {resource_id}")
+
+
 @subapp.command()
 @cli_error_handler
 def set_index(
@@ -199,16 +252,43 @@ def set_index(
 @subapp.command()
 @cli_error_handler
 @cli_timer
-def reindex_all(ctx: typer.Context, remove_old_index: Optional[bool] = remove_old_index_option):
+def reindex_all(
+    ctx: typer.Context,
+    remove_old_index: Optional[bool] = remove_old_index_option,
+    fetch_size: int = fetch_size_option,
+    processes: int = processes_option,
+    restart: bool = restart_option,
+):
     """
     Reindexes all resources in Karp, see `karp-cli resource reindex --help` for more details
     """
     from karp import search_commands
 
-    search_commands.reindex_all_resources(remove_old_index=remove_old_index)
+    search_commands.reindex_all_resources(
+        remove_old_index=remove_old_index, fetch_size=fetch_size, processes=processes, restart=restart
+    )
     typer.echo("Successfully reindexed all resrouces")
 
 
+@subapp.command()
+@cli_error_handler
+@cli_timer
+def convert_storage(
+    ctx: typer.Context,
+    resource_id: str = resource_option,
+    batch_size: int = typer.Option(1000, help="Number of entry versions to convert in each transaction"),
+):
+    """
+    Converts the stored entries of a resource to the storage mode in its config
+
+    - Run this after changing compressBody or snapshotInterval in the resource config, old versions are otherwise kept as they are
+    """
+    from karp import resource_commands
+
+    resource_commands.convert_storage(resource_id, batch_size=batch_size)
+    typer.echo(f"Successfully converted the entries of {resource_id}")
+
+
 @subapp.command("list")
 @cli_error_handler
 @cli_timer
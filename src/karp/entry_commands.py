@@ -1,28 +1,32 @@
 from collections import defaultdict
-from typing import Any, Dict, Generator, Iterable, Tuple
+from typing import Dict, Iterable, Tuple
 
 import sqlalchemy
 
-from karp import plugins
+from karp import search_commands
 from karp.foundation.timings import utc_now
 from karp.foundation.value_objects import UniqueId, unique_id
 from karp.globals import session
 from karp.lex import EntryDto
 from karp.lex.domain import errors
-from karp.lex.domain.entities import Resource
+from karp.lex.domain.entities import Entry, Resource
 from karp.lex.domain.errors import EntryNotFound, ResourceNotFound
-from karp.lex.infrastructure.sql import resource_repository
+from karp.lex.infrastructure.sql import index_outbox, resource_repository
 from karp.lex.infrastructure.sql.entries import EntryRepository
-from karp.search.domain.index_entry import IndexEntry
-from karp.search.infrastructure.opensearch import indices as es_index
-from karp.search.infrastructure.transformers import entry_transformer
+from karp.main import config
 
 
 class EntryCommands:
-    def __init__(self):
+    def __init__(self, wait_for_index: bool | None = None):
         self.added_entries = defaultdict(list)
         self.deleted_entries = defaultdict(list)
         self.in_transaction = False
+        # if False, changes are left in the index outbox for "karp-cli entries index-worker" to handle.
+        # if True, ES is updated before returning, so that the changes can be searched for directly.
+        # defaults to WAIT_FOR_INDEX in the environment
+        self.wait_for_index = config.WAIT_FOR_INDEX if wait_for_index is None else wait_for_index
+        # entries fetched in advance with prefetch_entries, only used inside a transaction
+        self.prefetched_entries = {}
 
     def _get_resource(self, resource_id: str) -> Resource:
         result = resource_repository.by_resource_id(resource_id)
@@ -36,12 +40,24 @@ class EntryCommands:
             raise ResourceNotFound(resource_id)
         return result
 
-    def _transform(self, config, entry: EntryDto) -> IndexEntry:
-        return next(self._transform_entries(config, [entry]))
+    def _get_entry(self, resource_id: str, entries: EntryRepository, _id) -> Entry:
+        if self.in_transaction and (entry := self.prefetched_entries.get((resource_id, str(_id)))):
+            return entry
+        return entries.by_id(_id)
 
-    def _transform_entries(self, config, entries: Iterable[EntryDto]) -> Generator[IndexEntry, Any, None]:
-        entries = plugins.transform_entries(config, entries, expand_plugins=plugins.INDEXED)
-        return (entry_transformer.transform(entry) for entry in entries)
+    def prefetch_entries(self, resource_id: str, ids: Iterable[UniqueId | str]) -> list[Entry]:
+        """
+        Fetch the given entries using a few queries, instead of one query per update_entry
+        or delete_entry call. The entries are only remembered inside a transaction.
+
+        Returns the entries that were found.
+        """
+        entries = self._get_entries(resource_id)
+        result = entries.by_ids(UniqueId.validate(_id) for _id in ids)
+        if self.in_transaction:
+            for entry in result:
+                self.prefetched_entries[(resource_id, str(entry.id))] = entry
+        return result
 
     def add_entries_in_chunks(
         self,
@@ -73,6 +89,8 @@ class EntryCommands:
         resource = self._get_resource(resource_id)
 
         entry_table = self._get_entries(resource_id)
+        # entries are written to the DB in bulk, once per chunk
+        unsaved_entries = []
         for i, (entry_id, entry_raw) in enumerate(entries):
             entry = resource.create_entry_from_dict(
                 entry_raw,
@@ -81,14 +99,17 @@ class EntryCommands:
                 id=entry_id,
                 timestamp=timestamp,
             )
-            entry_table.save(entry)
+            unsaved_entries.append(entry)
             created_db_entries.append(EntryDto.from_entry(entry))
 
             if chunk_size > 0 and i % chunk_size == 0:
+                entry_table.save_all(unsaved_entries)
+                unsaved_entries = []
                 self.added_entries[resource_id].extend(created_db_entries)
                 created_db_entries = []
                 self._commit()
 
+        entry_table.save_all(unsaved_entries)
         self.added_entries[resource_id].extend(created_db_entries)
         self._commit()
 
@@ -129,6 +150,8 @@ class EntryCommands:
         resource = self._get_resource(resource_id)
         entry_table = self._get_entries(resource_id)
 
+        # entries are written to the DB in bulk, once per chunk
+        unsaved_entries = []
         for i, entry_raw in enumerate(entries):
             entry = resource.create_entry_from_dict(
                 entry_raw["entry"],
@@ -137,14 +160,17 @@ class EntryCommands:
                 id=entry_raw.get("id") or unique_id.make_unique_id(),
                 timestamp=entry_raw.get("last_modified"),
             )
-            entry_table.save(entry)
+            unsaved_entries.append(entry)
 
             created_db_entries.append(EntryDto.from_entry(entry))
 
             if chunk_size > 0 and i % chunk_size == 0:
+                entry_table.save_all(unsaved_entries)
+                unsaved_entries = []
                 self.added_entries[resource_id].extend(created_db_entries)
                 self._commit()
 
+        entry_table.save_all(unsaved_entries)
         self.added_entries[resource_id].extend(created_db_entries)
         self._commit()
 
@@ -159,7 +185,7 @@ class EntryCommands:
         resource = self._get_resource(resource_id)
         entries = self._get_entries(resource_id)
         try:
-            current_db_entry = entries.by_id(_id)
+            current_db_entry = self._get_entry(resource_id, entries, _id)
         except EntryNotFound as err:
             raise EntryNotFound(
                 resource_id,
@@ -184,7 +210,7 @@ class EntryCommands:
     def delete_entry(self, resource_id, _id, user, version, message="Entry deleted", timestamp=None):
         resource = self._get_resource(resource_id)
         entries = self._get_entries(resource_id)
-        entry = entries.by_id(_id)
+        entry = self._get_entry(resource_id, entries, _id)
 
         if entry.discarded:
             return
@@ -201,27 +227,32 @@ class EntryCommands:
         self._commit()
 
     def _commit(self):
-        """Commits the session and updates ES, but not if in a transaction."""
+        """
+        Commits the session and updates ES, but not if in a transaction.
+
+        The changed entries are added to the index outbox in the same transaction, so that ES
+        can be updated later if it fails now. If wait_for_index is False, ES is not updated here.
+        """
 
         if self.in_transaction:
             return
 
         try:
+            outbox_ids = []
+            for resource_id, entry_dtos in self.added_entries.items():
+                outbox_ids.extend(index_outbox.add(resource_id, (entry_dto.id for entry_dto in entry_dtos)))
+            for resource_id, entry_ids in self.deleted_entries.items():
+                outbox_ids.extend(index_outbox.add(resource_id, entry_ids))
             session.commit()
         except sqlalchemy.exc.IntegrityError as e:
             session.rollback()
             raise errors.IntegrityError(str(e)) from None
+        finally:
+            self.added_entries.clear()
+            self.deleted_entries.clear()
 
-        for resource_id, entry_dtos in self.added_entries.items():
-            resource = self._get_resource(resource_id)
-            index_entries = self._transform_entries(resource.config, entry_dtos)
-            es_index.add_entries(resource.resource_id, index_entries)
-            es_index.refresh_index(resource.resource_id)
-        self.added_entries.clear()
-
-        for resource_id, entry_ids in self.deleted_entries.items():
-            es_index.delete_entries(resource_id, entry_ids=entry_ids)
-        self.deleted_entries.clear()
+        if self.wait_for_index and outbox_ids:
+            search_commands.apply_index_outbox(batch_size=len(outbox_ids), ids=outbox_ids)
 
     def start_transaction(self):
         """Runs commands inside a transaction. Nothing will be
@@ -239,6 +270,7 @@ class EntryCommands:
             raise RuntimeError("Can't commit when outside a transaction")
 
         self.in_transaction = False
+        self.prefetched_entries.clear()
         self._commit()
 
     def rollback(self):
@@ -250,3 +282,4 @@ class EntryCommands:
         self.in_transaction = True
         self.added_entries.clear()
         self.deleted_entries.clear()
+        self.prefetched_entries.clear()
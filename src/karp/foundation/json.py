@@ -1,5 +1,6 @@
 """Utilities for working with JSON objects."""
 
+import copy
 from itertools import takewhile
 from typing import Callable, Dict, Iterator, Union
 
@@ -187,6 +188,17 @@ def localise_path(path1, path2: Union[str, Path]) -> Path:
     return result
 
 
+def paths_overlap(path1: Union[str, Path], path2: Union[str, Path]) -> bool:
+    """
+    True if one of the paths is inside the other.
+    """
+
+    path1 = make_path(path1)
+    path2 = make_path(path2)
+    n = min(len(path1), len(path2))
+    return path1[:n] == path2[:n]
+
+
 def path_fields(path: Union[str, Path]) -> list[tuple[str, list[int]]]:
     """
     Convert a path into a list of (field name, list indexes) tuples.
@@ -373,3 +385,62 @@ def add_default_value(field, default_value, data):
     for path in expand_path(field[:-1], data):
         if not has_path(path + [field[-1]], data):
             set_path(path + [field[-1]], default_value, data)
+
+
+def make_delta(source, target, path=None) -> list:
+    """
+    Compute a list of operations that turns source into target, see apply_delta.
+    Unlike the diffs shown to users, the result is exact and can be stored as JSON.
+
+    >>> make_delta({"a": 1, "b": [1, 2]}, {"a": 2, "b": [1, 2, 3]})
+    [['set', ['a'], 2], ['ext', ['b'], [3]]]
+    """
+
+    path = path or []
+    result = []
+    if isinstance(source, dict) and isinstance(target, dict):
+        for key in source:
+            if key not in target:
+                result.append(["del", path + [key]])
+        for key, value in target.items():
+            if key in source:
+                result.extend(make_delta(source[key], value, path + [key]))
+            else:
+                result.append(["set", path + [key], value])
+
+    elif isinstance(source, list) and isinstance(target, list):
+        for i, (source_value, target_value) in enumerate(zip(source, target, strict=False)):
+            result.extend(make_delta(source_value, target_value, path + [i]))
+        if len(target) > len(source):
+            result.append(["ext", path, target[len(source) :]])
+        elif len(target) < len(source):
+            result.append(["cut", path, len(target)])
+
+    # compare types too, since 1 == True in Python but not in JSON
+    elif source != target or type(source) is not type(target):
+        result.append(["set", path, target])
+
+    return result
+
+
+def apply_delta(delta: list, data):
+    """
+    Apply the operations computed by make_delta to a copy of data and return it.
+    """
+
+    data = copy.deepcopy(data)
+    for op, path, *args in delta:
+        value = copy.deepcopy(args[0]) if args else None
+        if op == "del":
+            del_path(path, data)
+        elif op == "set" and not path:
+            data = value
+        elif op == "set":
+            set_path(path, value, data)
+        elif op == "ext":
+            get_path(path, data).extend(value)
+        elif op == "cut":
+            del get_path(path, data)[value:]
+        else:
+            raise ValueError(f"Unknown delta operation: '{op}'")
+    return data
@@ -0,0 +1,142 @@
+"""Run the stages of a stream processing job concurrently."""
+
+import contextvars
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, Optional
+
+
+@dataclass
+class StageStats:
+    name: str
+    items: int = 0
+    # time spent working, not waiting for the other stages
+    seconds: float = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.items / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return f"{self.name}: {self.items} items in {self.seconds:.2f}s ({self.rate:.0f} items/s)"
+
+
+class _Done:
+    pass
+
+
+@dataclass
+class _Failed:
+    error: BaseException
+
+
+def run_pipeline(
+    source: tuple[str, Callable[[], Iterable]],
+    *stages: tuple[str, Callable[[Iterator], Iterable]],
+    queue_size: int = 4,
+    chunk_size: int = 100,
+    stats: Optional[list[StageStats]] = None,
+) -> Iterator:
+    """
+    Run source and each stage in its own thread, connected by bounded queues, and yield the output
+    of the last stage. The stages are given as (name, function), where the source function takes no
+    arguments and the other ones take an iterator with the output of the previous stage. Items are
+    passed between the threads in chunks of chunk_size, and at most queue_size chunks wait between
+    two stages, so a slow stage makes the earlier ones wait instead of filling up memory.
+
+    The threads run in a copy of the current context, so they use the same database engine and
+    OpenSearch client, but a stage that uses the database must create its own session.
+
+    If stats is given, a StageStats per stage is appended to it and filled in while running.
+
+    An error in a stage is raised by the returned generator. If the generator is closed
+    before it is exhausted, the threads are stopped.
+    """
+    stop = threading.Event()
+    all_stats = [StageStats(name) for name, _ in (source, *stages)]
+    if stats is not None:
+        stats.extend(all_stats)
+
+    def put(out_queue, item):
+        while not stop.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def get(in_queue):
+        while not stop.is_set():
+            try:
+                return in_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _Done()
+
+    def run_stage(function, in_queue, out_queue, stage_stats):
+        waited = 0.0
+
+        def inputs():
+            nonlocal waited
+            while True:
+                before = time.perf_counter()
+                chunk = get(in_queue)
+                waited += time.perf_counter() - before
+                if isinstance(chunk, _Done):
+                    return
+                if isinstance(chunk, _Failed):
+                    raise chunk.error
+                yield from chunk
+
+        start = time.perf_counter()
+        chunk = []
+        try:
+            for item in function(inputs()) if in_queue is not None else function():
+                chunk.append(item)
+                stage_stats.items += 1
+                if len(chunk) == chunk_size:
+                    before = time.perf_counter()
+                    put(out_queue, chunk)
+                    waited += time.perf_counter() - before
+                    chunk = []
+                    if stop.is_set():
+                        return
+            if chunk:
+                put(out_queue, chunk)
+            put(out_queue, _Done())
+        except BaseException as e:  # noqa: BLE001
+            # not swallowed, the error is passed on through the stages and raised by run_pipeline
+            put(out_queue, _Failed(e))
+        finally:
+            stage_stats.seconds = time.perf_counter() - start - waited
+
+    in_queue = None
+    threads = []
+    for (_, function), stage_stats in zip((source, *stages), all_stats, strict=True):
+        out_queue = queue.Queue(maxsize=queue_size)
+        context = contextvars.copy_context()
+        threads.append(
+            threading.Thread(
+                target=context.run,
+                args=(run_stage, function, in_queue, out_queue, stage_stats),
+                daemon=True,
+            )
+        )
+        in_queue = out_queue
+
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            chunk = in_queue.get()
+            if isinstance(chunk, _Done):
+                break
+            if isinstance(chunk, _Failed):
+                raise chunk.error
+            yield from chunk
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
@@ -26,6 +26,8 @@ class EntryHistoryRequest(BaseModel):
     to_version: typing.Optional[int] = None
     current_page: int = 0
     page_size: int = 100
+    cursor: typing.Optional[str] = None
+    include_total: bool = True
 
 
 class EntryDiffDto(BaseModel):
@@ -46,4 +48,5 @@ class HistoryDto(IdMixin, BaseModel):
 
 class GetHistoryDto(BaseModel):
     history: list[HistoryDto]
-    total: int
+    total: typing.Optional[int] = None
+    next_cursor: typing.Optional[str] = None
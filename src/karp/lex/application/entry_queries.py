@@ -51,6 +51,16 @@ def by_id_optional(
     return None
 
 
+def by_ids(
+    resource_id: str,
+    ids: typing.Iterable[UniqueIdStr],
+    **kwargs,
+) -> list[EntryDto]:
+    """Fetch many entries in a few queries, entries that are not found are left out."""
+    entries = resource_repository.entries_by_resource_id(resource_id)
+    return list(_to_dtos(resource_id, entries.by_ids([UniqueId.validate(entry_id) for entry_id in ids]), **kwargs))
+
+
 def transform_entry_body(
     resource_id: str,
     entry_body: dict,
@@ -64,9 +74,33 @@ def count_all_entries(resource_id: str) -> int:
     return entries.count_all_entries()
 
 
-def all_entries(resource_id: str, last_modified: int | None = None, **kwargs) -> typing.Iterable[EntryDto]:
+def all_entries(
+    resource_id: str, last_modified: int | None = None, fetch_size: int | None = None, **kwargs
+) -> typing.Iterable[EntryDto]:
+    entries = resource_repository.entries_by_resource_id(resource_id)
+    return _to_dtos(resource_id, entries.all_entries(last_modified=last_modified, fetch_size=fetch_size), **kwargs)
+
+
+def entries_by_id_range(
+    resource_id: str,
+    after_id: typing.Optional[UniqueIdStr] = None,
+    until_id: typing.Optional[UniqueIdStr] = None,
+    fetch_size: int | None = None,
+    **kwargs,
+) -> typing.Iterable[EntryDto]:
+    entries = resource_repository.entries_by_resource_id(resource_id)
+    after_id = UniqueId.validate(after_id) if after_id is not None else None
+    until_id = UniqueId.validate(until_id) if until_id is not None else None
+    return _to_dtos(
+        resource_id,
+        entries.entries_by_id_range(after_id=after_id, until_id=until_id, fetch_size=fetch_size),
+        **kwargs,
+    )
+
+
+def partition_ids(resource_id: str, partitions: int, after_id: typing.Optional[UniqueIdStr] = None) -> list[UniqueId]:
     entries = resource_repository.entries_by_resource_id(resource_id)
-    return _to_dtos(resource_id, entries.all_entries(last_modified=last_modified), **kwargs)
+    return entries.partition_ids(partitions, after_id=UniqueId.validate(after_id) if after_id is not None else None)
 
 
 def deleted_entries(resource_id: str, last_modified: int | None = None) -> typing.Iterable[str]:
@@ -94,7 +128,7 @@ def get_history(
 ) -> GetHistoryDto:
     logger.info("querying history", extra={"request": request})
     entries = resource_repository.entries_by_resource_id(request.resource_id)
-    paged_query, total = entries.get_history(
+    paged_query, total, next_cursor = entries.get_history(
         entry_id=request.entry_id,
         user_id=request.user_id,
         from_date=request.from_date,
@@ -103,21 +137,11 @@ def get_history(
         to_version=request.to_version,
         offset=request.current_page * request.page_size,
         limit=request.page_size,
+        cursor=request.cursor,
+        include_total=request.include_total,
     )
     result = []
-    previous_body: dict[str, typing.Any] = {}
-    for history_entry in paged_query:
-        # TODO fix this, we should get the diff in another way, probably store the diffs directly in the database
-        # entry_version = history_entry.version
-        # if entry_version > 1:
-        #     previous_entry = entries.by_entry_id(
-        #         history_entry.entry_id, version=entry_version - 1
-        #     )
-        #     previous_body = previous_entry.body
-        # else:
-        #     previous_body = {}
-        history_diff = jsondiff.compare(previous_body, history_entry.body)
-        logger.debug("diff", extra={"diff": history_diff})
+    for history_entry, history_diff in paged_query:
         result.append(
             HistoryDto(
                 timestamp=history_entry.last_modified,
@@ -130,9 +154,8 @@ def get_history(
                 entry=history_entry.body,
             )
         )
-        previous_body = history_entry.body
 
-    return GetHistoryDto(history=result, total=total)
+    return GetHistoryDto(history=result, total=total, nextCursor=next_cursor)
 
 
 def get_entry_diff(
@@ -1,18 +1,24 @@
+import itertools
 from collections import defaultdict
-from dataclasses import dataclass
-from typing import Iterable, List
-
-from karp.foundation.json import get_path
-from karp.lex.infrastructure.sql import resource_repository
-from karp.plugins import INDEXED, expansion_phases, transform_list
+from dataclasses import dataclass, replace
+from typing import Iterable, Iterator, List
+
+from karp.foundation.batch import batch_items
+from karp.foundation.cache import LRUCache
+from karp.foundation.json import filter_paths, get_path, make_path, path_str, paths_overlap
+from karp.lex.infrastructure.sql import resource_repository, search_generations
+from karp.main import config as karp_config
+from karp.plugins import INDEXED, expansion_phases, find_virtual_fields, transform_list
 from karp.search.domain import QueryRequest
+from karp.search.domain.query_dsl.karp_query_model import ModelBase
 from karp.search.infrastructure.opensearch import search_service
 
 
 @dataclass
 class _Result:
-    path: str
+    path: str | None
     result: dict
+    fields: tuple[str, ...] = ()
 
 
 """
@@ -22,8 +28,8 @@ Takes care of expanding plugins when results are fetched.
 """
 
 
-def _transform_result(path, result, expand_plugins=True):
-    return _transform_results([_Result(path, result)], expand_plugins)[0]
+def _transform_result(path, result, expand_plugins=True, fields=()):
+    return _transform_results([_Result(path, result, tuple(fields))], expand_plugins)[0]
 
 
 def _transform_results(results, expand_plugins=True):
@@ -36,39 +42,152 @@ def _transform_results(results, expand_plugins=True):
         for j, hit in enumerate(result.result["hits"]):
             hits_by_resource[hit["resource"]].append((i, j))
 
+    # only the virtual fields that are returned need to be expanded
+    entry_fields = [_entry_fields([result.path, *result.fields]) for result in results]
+
     for resource, hit_ids in hits_by_resource.items():
         config = resource_repository.by_resource_id(resource).config
         hits = [results[i].result["hits"][j]["entry"] for i, j in hit_ids]
-        hits = transform_list(config, hits, expand_plugins=phases)
+        needed = [entry_fields[i] for i in {i for i, _ in hit_ids}]
+        fields = None if None in needed else [field for fields in needed for field in fields]
+        hits = transform_list(config, hits, expand_plugins=phases, fields=fields)
         for (i, j), hit in zip(hit_ids, hits, strict=False):
             results[i].result["hits"][j]["entry"] = hit
 
-    # Handle path field
+    # Handle fields and path
     for result in results:
+        if result.fields:
+            for hit in result.result["hits"]:
+                _select_fields(result.fields, hit)
         if result.path:
             result.result["hits"] = [get_path(result.path, entry) for entry in result.result["hits"]]
 
     return [result.result for result in results]
 
 
+def _entry_fields(paths: Iterable[str | None]) -> list[str] | None:
+    """
+    The fields of the entry that are needed to return the given paths of the hits, for example
+    "entry.baseform" needs "baseform" and "id" needs none. None means that the whole entry is needed.
+    """
+    paths = [make_path(path) for path in paths if path]
+    if not paths:
+        return None
+    result = []
+    for path in paths:
+        if path[0] == "entry":
+            if len(path) == 1:
+                return None
+            result.append(path_str(path[1:]))
+    return result
+
+
+def _select_fields(fields: Iterable[str], hit: dict):
+    """Remove everything from hit that is not in, or on the way to, one of the fields."""
+    field_paths = [make_path(field) for field in fields]
+
+    def keep(path, _value):
+        path = make_path(path_str(path, strip_positions=True))
+        return any(paths_overlap(path, field_path) for field_path in field_paths)
+
+    filter_paths(keep, hit)
+
+
+def _prepare(query: QueryRequest) -> tuple[QueryRequest, str | None, list[str]]:
+    """
+    Take path and fields out of the query, since they are applied after the plugins have been
+    expanded, and use them to only fetch the needed fields of the entries from the index.
+
+    If a virtual field that is expanded after the search is needed, its plugin can read any
+    field of the entry, so then the whole entries are fetched.
+    """
+    source_includes = _entry_fields([query.path, *query.fields])
+    if source_includes is not None:
+        field_paths = [make_path(field) for field in source_includes]
+        for resource in query.resources:
+            config = resource_repository.by_resource_id(resource).config
+            for name, field in find_virtual_fields(config).items():
+                if not field.searchable and any(paths_overlap(name, path) for path in field_paths):
+                    source_includes = None
+    search_query = replace(query, path=None, fields=[], source_includes=source_includes)
+    return search_query, query.path, query.fields
+
+
+# responses of query and query_stats, see _cache_key, they are shared and must not be modified
+result_cache = LRUCache(karp_config.QUERY_RESULT_CACHE_SIZE, ttl=karp_config.QUERY_RESULT_CACHE_TTL)
+
+
+def _cache_key(*args, resources: Iterable[str]):
+    """
+    The key for a cached response: the arguments of the request and the search generations of the
+    resources, which are increased every time an index changes. Virtual fields that are not
+    searchable are expanded when the response is created and may read other resources, so then
+    the generations of all resources are used.
+    """
+    generations = search_generations.get_all()
+    resources = list(resources)
+    for resource in resources:
+        config = resource_repository.by_resource_id(resource).config
+        if any(not field.searchable for field in find_virtual_fields(config).values()):
+            return *args, tuple(sorted(generations.items()))
+    return *args, tuple(generations.get(resource, 0) for resource in resources)
+
+
 def query(query: QueryRequest, **kwargs):
-    path = query.path
-    query.path = None  # we need the full path to expand plugins
-    result = search_service.query(query)
-    return _transform_result(path, result, **kwargs)
+    # a complete result set can be very large, so only pages are cached, and a cursor is only valid
+    # for a limited time
+    key = None
+    # queries that are already parsed (from plugins) are not cached, since their repr is not a reliable key
+    if not isinstance(query.q, ModelBase) and query.size is not None and query.cursor is None:
+        # no q and an empty q both match all entries
+        normalized = replace(query, q=query.q or None)
+        key = _cache_key("query", repr(normalized), tuple(sorted(kwargs.items())), resources=query.resources)
+        if (result := result_cache.get(key)) is not None:
+            return result
+
+    search_query, path, fields = _prepare(query)
+    result = search_service.query(search_query)
+    result = _transform_result(path, result, fields=fields, **kwargs)
+    if key is not None:
+        result_cache.put(key, result)
+    return result
+
+
+def scan(query: QueryRequest, batch_size=1000, **kwargs) -> Iterator[dict]:
+    """
+    Yield every hit for the query. The hits are read from the index and their plugins are expanded
+    in batches that start small and grow to batch_size hits.
+    """
+    search_query, path, fields = _prepare(query)
+    for hits in batch_items(search_service.scan(search_query, page_size=batch_size), batch_size):
+        yield from _transform_result(path, {"hits": hits}, fields=fields, **kwargs)["hits"]
+
+
+def stream(query: QueryRequest, batch_size=1000, **kwargs) -> Iterator[dict]:
+    """
+    Yield the hits that query() would return, from from_ to from_ + size (or all after from_ if size
+    is None), but without the 10000 hit limit and without keeping all of them in memory.
+    """
+    stop = None if query.size is None else query.from_ + query.size
+    if stop is not None:
+        batch_size = max(1, min(batch_size, stop))
+    return itertools.islice(scan(query, batch_size=batch_size, **kwargs), query.from_, stop)
 
 
 def query_stats(resources, q):
-    return search_service.query_stats(resources, q)
+    key = _cache_key("query_stats", tuple(resources), q, resources=resources)
+    if (result := result_cache.get(key)) is None:
+        result = search_service.query_stats(resources, q)
+        result_cache.put(key, result)
+    return result
 
 
 def multi_query(queries: list[QueryRequest], **kwargs):
-    queries = list(queries)
-    paths = [q.path for q in queries]
-    for q in queries:
-        q.path = None
-    results = search_service.multi_query(queries)
-    return _transform_results([_Result(p, r) for p, r in zip(paths, results, strict=False)], **kwargs)
+    prepared = [_prepare(q) for q in queries]
+    results = search_service.multi_query([search_query for search_query, _, _ in prepared])
+    return _transform_results(
+        [_Result(path, r, tuple(fields)) for (_, path, fields), r in zip(prepared, results, strict=False)], **kwargs
+    )
 
 
 def search_ids(resource_id: str, entry_ids: List[str], **kwargs):
@@ -31,6 +31,16 @@ class ResourceConfig(BaseModel):
     protected: dict[str, bool] = {}
     id: Optional[str] = None
     additional_properties: bool = True
+    # how entries are stored in the database, run "karp-cli resource convert-storage" after changing.
+    # compress_body: store the entry bodies compressed
+    # snapshot_interval: if set, only the latest and every snapshot_interval:th version of an entry is
+    # stored in full, the other versions are stored as deltas
+    compress_body: bool = False
+    snapshot_interval: Optional[int] = None
+    # when edits become searchable: "immediate" (refresh the index after each edit), "wait_for" (edits
+    # wait for the next scheduled refresh), an interval such as "500ms" or "5s" (refresh periodically,
+    # edits return directly) or "none" (only refreshed by reindex). Defaults to INDEX_REFRESH_POLICY
+    refresh_policy: Optional[str] = pydantic.Field(None, pattern=r"^(immediate|wait_for|none|\d+(ms|s))$")
     config_str: str
 
     @classmethod
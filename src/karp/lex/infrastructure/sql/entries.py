@@ -1,15 +1,21 @@
+import base64
+import json
 import logging
 import typing
 from typing import Dict, List, Optional
 
 import sqlalchemy as sa
+from sb_json_tools import jsondiff
 from sqlalchemy import Engine, sql
+from sqlalchemy.orm import Session
 
+from karp.foundation.json import apply_delta, make_delta
 from karp.foundation.value_objects import UniqueId
 from karp.globals import session
 from karp.lex.domain import errors
 from karp.lex.domain.entities import Resource
 from karp.lex.domain.entities.entry import Entry
+from karp.main.errors import UserError
 
 from ...domain.errors import EntryNotFound
 from . import models
@@ -23,6 +29,7 @@ class EntryRepository:
         self._config = resource.config
         self.resource = resource
         self.history_model = models.get_or_create_entry_history_model(resource.table_name)
+        self.latest_model = models.get_or_create_entry_latest_model(resource.table_name)
 
     def by_id(
         self,
@@ -62,13 +69,232 @@ class EntryRepository:
         # automatically commits the transaction, which we don't want
         # (using self._engine makes it run in its own transaction)
         self.history_model.__table__.create(bind=self._engine, checkfirst=True)
+        self.latest_model.__table__.create(bind=self._engine, checkfirst=True)
 
     def drop_table(self):
+        self.latest_model.__table__.drop(bind=self._engine, checkfirst=True)
         self.history_model.__table__.drop(bind=self._engine, checkfirst=True)
 
     def save(self, entry: Entry):
-        entry_dto = self.history_model.from_entity(entry)
+        previous_body = self._previous_body(entry)
+        entry_dto = self.history_model.from_entity(
+            entry, diff=jsondiff.compare(previous_body or {}, entry.body), compress=self._compress
+        )
         session.add(entry_dto)
+        self._store_previous_as_delta(entry, previous_body)
+        # keep the pointer to the latest version up to date, in the same transaction
+        latest = self.latest_model(entity_id=entry.entity_id, version=entry.version)
+        if entry.version == 1:
+            # a new entry, so there is no pointer to update
+            session.add(latest)
+        else:
+            session.merge(latest)
+
+    def save_all(self, entries: typing.Iterable[Entry]):
+        """
+        Save many entries using bulk INSERT statements (executemany), bypassing the
+        bookkeeping the ORM does for each object in save.
+        """
+        entries = list(entries)
+        if not entries:
+            return
+        previous_bodies = [self._previous_body(entry) for entry in entries]
+        try:
+            session.execute(
+                sql.insert(self.history_model),
+                [
+                    self.history_model.values_from_entity(
+                        entry, diff=jsondiff.compare(previous_body or {}, entry.body), compress=self._compress
+                    )
+                    for entry, previous_body in zip(entries, previous_bodies, strict=True)
+                ],
+            )
+            new_entries = [entry for entry in entries if entry.version == 1]
+            if new_entries:
+                session.execute(
+                    sql.insert(self.latest_model),
+                    [{"entity_id": entry.entity_id, "version": entry.version} for entry in new_entries],
+                )
+        except sa.exc.IntegrityError as e:
+            # the statements are executed directly, so report errors the same way as a failed commit
+            session.rollback()
+            raise errors.IntegrityError(str(e)) from None
+        for entry, previous_body in zip(entries, previous_bodies, strict=True):
+            if entry.version != 1:
+                self._store_previous_as_delta(entry, previous_body)
+                session.merge(self.latest_model(entity_id=entry.entity_id, version=entry.version))
+
+    def _previous_body(self, entry: Entry) -> Optional[dict]:
+        """
+        The body of the version before entry, if any. The diff against it is stored with each version,
+        so that listing history does not need to compute any diffs.
+        """
+        if entry.version == 1:
+            return None
+        stmt = sql.select(
+            self.history_model.body, self.history_model.body_compressed, self.history_model.delta
+        ).filter_by(entity_id=entry.entity_id, version=entry.version - 1)
+        row = session.execute(stmt).one_or_none()
+        if row is None:
+            return None
+        if row.delta is not None:
+            # only happens if the previous version is not the latest one
+            return self._reconstruct_body(entry.entity_id, entry.version - 1)
+        return models.row_body(row)
+
+    @property
+    def _compress(self) -> bool:
+        return self.config.compress_body
+
+    def _keep_as_snapshot(self, version: int) -> bool:
+        interval = self.config.snapshot_interval
+        return not interval or version % interval == 0
+
+    def _store_previous_as_delta(self, entry: Entry, previous_body: Optional[dict]):
+        """
+        With snapshot_interval set, the previous version (which was the latest one) is replaced
+        by a delta against entry, unless it is one of the periodic snapshots.
+        """
+        if previous_body is None or self._keep_as_snapshot(entry.version - 1):
+            return
+        stmt = (
+            sql.update(self.history_model)
+            .filter_by(entity_id=entry.entity_id, version=entry.version - 1)
+            .values(body=None, body_compressed=None, delta=make_delta(entry.body, previous_body))
+        )
+        session.execute(stmt, execution_options={"synchronize_session": False})
+
+    def _reconstruct_body(self, entity_id: UniqueId, version: int) -> dict:
+        """
+        Reconstruct the body of a version stored as a delta, by applying the deltas down from the
+        closest version above it that is stored in full. The latest version is always stored in
+        full, so at most snapshot_interval versions are read.
+        """
+        stmt = (
+            sql.select(self.history_model.body, self.history_model.body_compressed, self.history_model.delta)
+            .where(self._delta_chain(entity_id, version, version))
+            .order_by(self.history_model.version.desc())
+        )
+        snapshot, *deltas = session.execute(stmt).all()
+        body = models.row_body(snapshot)
+        for row in deltas:
+            body = apply_delta(row.delta, body)
+        return body
+
+    def _reconstruct_bodies(self, rows) -> dict[tuple[UniqueId, int], dict]:
+        """
+        Reconstruct the bodies of the given history rows that are stored as deltas, keyed by
+        (entity_id, version). Uses one query, in which the versions of each entry are read once,
+        from its oldest given version up to the closest version stored in full above its newest.
+        """
+        versions: dict[UniqueId, set[int]] = {}
+        for row in rows:
+            if row.delta is not None:
+                versions.setdefault(row.entity_id, set()).add(row.version)
+        if not versions:
+            return {}
+
+        stmt = (
+            sql.select(
+                self.history_model.entity_id,
+                self.history_model.version,
+                self.history_model.body,
+                self.history_model.body_compressed,
+                self.history_model.delta,
+            )
+            .where(
+                sa.or_(
+                    *(
+                        self._delta_chain(entity_id, min(entity_versions), max(entity_versions))
+                        for entity_id, entity_versions in versions.items()
+                    )
+                )
+            )
+            .order_by(self.history_model.entity_id, self.history_model.version.desc())
+        )
+        bodies = {}
+        body = None
+        # the versions of each entry start with one that is stored in full
+        for row in session.execute(stmt):
+            body = models.row_body(row) if row.delta is None else apply_delta(row.delta, body)
+            if row.version in versions[row.entity_id]:
+                bodies[row.entity_id, row.version] = body
+        return bodies
+
+    def _delta_chain(self, entity_id: UniqueId, oldest: int, newest: int):
+        """
+        A condition for the versions oldest..newest of an entry and the ones above them, up to the
+        closest version above newest that is stored in full.
+        """
+        snapshot_version = (
+            sql.select(sa.func.min(self.history_model.version))
+            .where(
+                self.history_model.entity_id == entity_id,
+                self.history_model.version > newest,
+                self.history_model.delta.is_(None),
+            )
+            .scalar_subquery()
+        )
+        return sa.and_(
+            self.history_model.entity_id == entity_id,
+            self.history_model.version >= oldest,
+            self.history_model.version <= snapshot_version,
+        )
+
+    def convert_storage(self, batch_size: int = 1000) -> typing.Iterator[int]:
+        """
+        Rewrite the stored versions so that they are stored according to compress_body and
+        snapshot_interval in the resource config. Works through the versions batch_size rows at
+        a time and yields the number of rows read after each batch, so that the caller can commit.
+        """
+        # go through all versions of each entry, starting with the latest one, which is always stored
+        # in full. the full body of the following version is needed to decode (or encode) a delta.
+        columns = [
+            self.history_model.history_id,
+            self.history_model.entity_id,
+            self.history_model.version,
+            self.history_model.body,
+            self.history_model.body_compressed,
+            self.history_model.delta,
+        ]
+        next_entity_id, next_version, next_body = None, None, None
+        while True:
+            stmt = sql.select(*columns)
+            if next_entity_id is not None:
+                stmt = stmt.where(
+                    sa.or_(
+                        self.history_model.entity_id < next_entity_id,
+                        sa.and_(
+                            self.history_model.entity_id == next_entity_id,
+                            self.history_model.version < next_version,
+                        ),
+                    )
+                )
+            stmt = stmt.order_by(self.history_model.entity_id.desc(), self.history_model.version.desc())
+            rows = session.execute(stmt.limit(batch_size)).all()
+            if not rows:
+                return
+
+            updates = []
+            for row in rows:
+                is_latest = row.entity_id != next_entity_id
+                if is_latest or row.delta is None:
+                    body = models.row_body(row)
+                else:
+                    body = apply_delta(row.delta, next_body)
+
+                if is_latest or self._keep_as_snapshot(row.version):
+                    values = {**models.body_values(body, compress=self._compress), "delta": None}
+                else:
+                    values = {"body": None, "body_compressed": None, "delta": make_delta(next_body, body)}
+                if values != {"body": row.body, "body_compressed": row.body_compressed, "delta": row.delta}:
+                    updates.append({"history_id": row.history_id, **values})
+                next_entity_id, next_version, next_body = row.entity_id, row.version, body
+
+            if updates:
+                # an UPDATE by primary key per row, executed as one executemany
+                session.execute(sql.update(self.history_model), updates)
+            yield len(rows)
 
     def entity_ids(self) -> List[str]:
         stmt = self._stmt_latest_not_discarded()
@@ -125,22 +351,112 @@ class EntryRepository:
         row = query.first()
         return self._history_row_to_entry(row) if row else None
 
+    def by_ids(self, ids: typing.Iterable[UniqueId], *, chunk_size: int = 500) -> List[Entry]:
+        """
+        Fetch the latest version of each of the given entries, using one query per chunk_size ids.
+        Entries that are not found are left out.
+        """
+        ids = list(ids)
+        result = []
+        for i in range(0, len(ids), chunk_size):
+            stmt = sql.select(self.history_model).join(
+                self.latest_model,
+                sa.and_(
+                    self.history_model.entity_id == self.latest_model.entity_id,
+                    self.history_model.version == self.latest_model.version,
+                    self.latest_model.entity_id.in_(ids[i : i + chunk_size]),
+                ),
+            )
+            result.extend(self._history_row_to_entry(row) for row in session.execute(stmt).scalars())
+        return result
+
     def count_all_entries(self) -> int:
         stmt = self._stmt_latest_not_discarded()
         stmt = sql.select(sa.func.count()).select_from(stmt)
         return session.execute(stmt).scalar_one()
 
-    def all_entries(self, last_modified: int | None = None) -> typing.Iterable[Entry]:
+    def all_entries(self, last_modified: int | None = None, fetch_size: int | None = None) -> typing.Iterable[Entry]:
+        """
+        If fetch_size is given, the entries are streamed from the database fetch_size rows at
+        a time, instead of loading the whole result into memory.
+        """
         stmt = self._stmt_latest_not_discarded(last_modified=last_modified)
-        query = session.execute(stmt).scalars()
+        query = self._execute(stmt, fetch_size)
 
         return (self._history_row_to_entry(db_entry) for db_entry in query)
 
+    def entries_by_id_range(
+        self,
+        after_id: Optional[UniqueId] = None,
+        until_id: Optional[UniqueId] = None,
+        fetch_size: int | None = None,
+    ) -> typing.Iterable[Entry]:
+        """
+        The latest versions of the non-discarded entries with after_id < id <= until_id, in id order.
+        Either bound can be left out. Used to process all entries in parts, since the ids are sortable.
+        """
+        stmt = self._stmt_latest_not_discarded()
+        if after_id is not None:
+            stmt = stmt.where(self.latest_model.entity_id > after_id)
+        if until_id is not None:
+            stmt = stmt.where(self.latest_model.entity_id <= until_id)
+        stmt = stmt.order_by(self.latest_model.entity_id)
+        return (self._history_row_to_entry(db_entry) for db_entry in self._execute(stmt, fetch_size))
+
+    def partition_ids(self, partitions: int, after_id: Optional[UniqueId] = None) -> List[UniqueId]:
+        """
+        Ids that split the non-discarded entries with id > after_id into (at most) partitions parts
+        of about the same size. Part i is then given by entries_by_id_range(ids[i - 1], ids[i]).
+
+        The ids are taken from the data, since ULIDs start with a timestamp and are not evenly spread.
+        """
+        stmt = sql.select(self.latest_model.entity_id).join(
+            self.history_model,
+            sa.and_(
+                self.history_model.entity_id == self.latest_model.entity_id,
+                self.history_model.version == self.latest_model.version,
+                self.history_model.discarded == False,  # noqa: E712
+            ),
+        )
+        if after_id is not None:
+            stmt = stmt.where(self.latest_model.entity_id > after_id)
+        count = session.execute(sql.select(sa.func.count()).select_from(stmt.subquery())).scalar_one()
+
+        stmt = stmt.order_by(self.latest_model.entity_id)
+        result = []
+        for i in range(1, partitions):
+            offset = count * i // partitions
+            if offset == 0:
+                continue
+            entity_id = session.execute(stmt.offset(offset - 1).limit(1)).scalar_one()
+            if not result or result[-1] != entity_id:
+                result.append(entity_id)
+        return result
+
     def deleted_entries(self, last_modified: int | None = None) -> typing.Iterable[str]:
         stmt = self._stmt_latest_discarded(last_modified=last_modified)
         query = session.execute(stmt).scalars()
         return (db_entry.entity_id for db_entry in query)
 
+    def _execute(self, stmt, fetch_size: int | None = None) -> typing.Iterable:
+        if not fetch_size:
+            return session.execute(stmt).scalars()
+        return self._stream(stmt, fetch_size)
+
+    def _stream(self, stmt, fetch_size: int) -> typing.Iterator:
+        options = {"yield_per": fetch_size}
+        if self._engine.dialect.name == "sqlite":
+            # SQLite does not buffer results, and since all sessions share the same connection
+            # (SingletonThreadPool) we can't use a separate session
+            yield from session.execute(stmt, execution_options=options).scalars()
+            return
+
+        # yield_per uses a server-side cursor, which blocks the connection until all rows are read.
+        # Use a separate session, so that the main session can be used (by plugins for example)
+        # while streaming.
+        with Session(bind=self._engine) as stream_session:
+            yield from stream_session.execute(stmt, execution_options=options).scalars()
+
     def get_max_last_modified(self):
         stmt = sql.select(sa.func.max(self.history_model.last_modified))
         return next(session.execute(stmt).scalars())
@@ -155,29 +471,18 @@ class EntryRepository:
         """
         For each entry id, fetch the latest version, either discarded och non-discarded entries
         """
-        subq = self._subq_for_latest()
         and_params = [
-            self.history_model.entity_id == subq.c.entity_id,
-            self.history_model.history_id == subq.c.history_id,
+            self.history_model.entity_id == self.latest_model.entity_id,
+            self.history_model.version == self.latest_model.version,
             self.history_model.discarded == discarded,
         ]
         if last_modified:
             and_params.append(self.history_model.last_modified > last_modified)
         return sql.select(self.history_model).join(
-            subq,
+            self.latest_model,
             sa.and_(*and_params),
         )
 
-    def _subq_for_latest(self) -> sql.Subquery:
-        return (
-            sql.select(
-                self.history_model.entity_id,
-                sa.func.max(self.history_model.history_id).label("history_id"),
-            )
-            .group_by(self.history_model.entity_id)
-            .subquery("t2")
-        )
-
     def get_history(
         self,
         user_id: Optional[str] = None,
@@ -188,7 +493,17 @@ class EntryRepository:
         to_version: Optional[int] = None,
         offset: int = 0,
         limit: int = 100,
-    ):
+        cursor: Optional[str] = None,
+        include_total: bool = True,
+    ) -> tuple[List[tuple[Entry, list[dict]]], Optional[int], Optional[str]]:
+        """
+        Returns a page of history entries (with the diff against the previous version), newest first,
+        the total number of matching rows
+        (None if include_total is False) and a cursor for the next page (None if this is the last page).
+
+        If cursor is given, offset is ignored and the page starts right after the row the cursor points to,
+        which makes deep pages as cheap as the first one.
+        """
         query = session.query(self.history_model)
         if user_id:
             query = query.filter_by(last_modified_by=user_id)
@@ -203,15 +518,44 @@ class EntryRepository:
         elif to_date is not None:
             query = query.filter(self.history_model.last_modified <= to_date)
 
-        paged_query = query.order_by(self.history_model.last_modified.desc())
-        paged_query = paged_query.limit(limit).offset(offset)
+        paged_query = query
+        if cursor:
+            last_modified, history_id = _decode_cursor(cursor)
+            paged_query = paged_query.filter(
+                sa.or_(
+                    self.history_model.last_modified < last_modified,
+                    sa.and_(
+                        self.history_model.last_modified == last_modified,
+                        self.history_model.history_id < history_id,
+                    ),
+                )
+            )
+        else:
+            paged_query = paged_query.offset(offset)
+        paged_query = paged_query.order_by(
+            self.history_model.last_modified.desc(), self.history_model.history_id.desc()
+        )
+        # fetch one extra row to find out if there is a next page
+        rows = paged_query.limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor(rows[-1].last_modified, rows[-1].history_id)
 
-        total = query.count()
-        return [self._history_row_to_entry(row) for row in paged_query.all()], total
+        total = query.count() if include_total else None
+        # versions stored as deltas are reconstructed for the whole page at once
+        bodies = self._reconstruct_bodies(rows)
+        entries = [
+            (self._history_row_to_entry(row, bodies.get((row.entity_id, row.version))), row.diff) for row in rows
+        ]
+        return entries, total, next_cursor
 
-    def _history_row_to_entry(self, row) -> Entry:
+    def _history_row_to_entry(self, row, body: Optional[dict] = None) -> Entry:
+        if body is None:
+            body = self._reconstruct_body(row.entity_id, row.version) if row.delta is not None else models.row_body(row)
         return Entry(
-            body=row.body,
+            body=body,
             message=row.message,
             status=row.status,
             op=row.op,
@@ -222,3 +566,15 @@ class EntryRepository:
             version=row.version,
             resource_id=self.resource.resource_id,
         )
+
+
+def _encode_cursor(last_modified: float, history_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([last_modified, history_id]).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[float, int]:
+    try:
+        last_modified, history_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(last_modified), int(history_id)
+    except (ValueError, TypeError):
+        raise UserError(f"Invalid cursor: '{cursor}'") from None
@@ -0,0 +1,49 @@
+"""
+The index outbox lists entries that have been changed in the database but not yet in the
+search index. Since the outbox is written in the same transaction as the entries, no change
+is lost if the process dies before the index has been updated.
+"""
+
+import typing
+
+from sqlalchemy import sql
+
+from karp.foundation.timings import utc_now
+from karp.foundation.value_objects import UniqueId
+from karp.globals import session
+
+from .models import IndexOutboxModel
+
+
+def add(resource_id: str, entity_ids: typing.Iterable[UniqueId]) -> list[int]:
+    """Add entries to the outbox, returns the ids of the new rows."""
+    now = utc_now()
+    rows = [IndexOutboxModel(resource_id=resource_id, entity_id=entity_id, created_at=now) for entity_id in entity_ids]
+    session.add_all(rows)
+    session.flush()
+    return [row.id for row in rows]
+
+
+def pending(limit: int, ids: typing.Optional[typing.Iterable[int]] = None) -> list[IndexOutboxModel]:
+    """The oldest rows in the outbox, optionally only the rows with the given ids."""
+    stmt = sql.select(IndexOutboxModel)
+    if ids is not None:
+        stmt = stmt.where(IndexOutboxModel.id.in_(list(ids)))
+    stmt = stmt.order_by(IndexOutboxModel.id).limit(limit)
+    return list(session.execute(stmt).scalars())
+
+
+def for_entries(resource_id: str, entity_ids: typing.Iterable[UniqueId]) -> list[int]:
+    """The ids of all rows in the outbox for the given entries."""
+    stmt = sql.select(IndexOutboxModel.id).where(
+        IndexOutboxModel.resource_id == resource_id, IndexOutboxModel.entity_id.in_(list(entity_ids))
+    )
+    return list(session.execute(stmt).scalars())
+
+
+def remove(ids: typing.Iterable[int]):
+    session.execute(sql.delete(IndexOutboxModel).where(IndexOutboxModel.id.in_(list(ids))))
+
+
+def count() -> int:
+    return session.execute(sql.select(sql.func.count()).select_from(IndexOutboxModel)).scalar_one()
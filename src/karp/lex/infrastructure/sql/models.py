@@ -1,13 +1,16 @@
 import functools
+import json
+import zlib
 
 from sqlalchemy import (
     JSON,
     Column,
     Enum,
+    Index,
     Integer,
     String,
 )
-from sqlalchemy.dialects.mysql import LONGTEXT
+from sqlalchemy.dialects.mysql import LONGBLOB, LONGTEXT
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.schema import (
     UniqueConstraint,
@@ -125,24 +128,111 @@ class BaseHistoryEntry:
     message = Column(Text(length=120))
     op = Column(Enum(EntryOp), nullable=False)
     discarded = Column(Boolean, default=False)
+    # the diff against the previous version, computed when the version is saved
+    diff = Column(JSON, nullable=True)
+    # if the resource is configured with compress_body, the body is stored here and body is null
+    body_compressed = Column(LONGBLOB, nullable=True)
+    # if the resource is configured with snapshot_interval, old versions are stored as a delta
+    # (see karp.foundation.json.make_delta) against the next version, and body is null
+    delta = Column(JSON(none_as_null=True), nullable=True)
 
     __table_args__ = (UniqueConstraint("entity_id", "version", name="id_version_unique_constraint"),)
 
     @classmethod
-    def from_entity(cls, entry: entities.Entry):
-        return cls(
-            history_id=None,
-            entity_id=entry.entity_id,
-            # entry_id=entry.entry_id,
-            version=entry.version,
-            last_modified=entry.last_modified,
-            last_modified_by=entry.last_modified_by,
-            body=entry.body,
-            status=entry.status,
-            message=entry.message,
-            op=entry.op,
-            discarded=entry.discarded,
-        )
+    def from_entity(cls, entry: entities.Entry, diff: list[dict] | None = None, compress: bool = False):
+        return cls(history_id=None, **cls.values_from_entity(entry, diff=diff, compress=compress))
+
+    @staticmethod
+    def values_from_entity(entry: entities.Entry, diff: list[dict] | None = None, compress: bool = False) -> dict:
+        """The column values of entry, as used by bulk INSERT statements."""
+        return {
+            "entity_id": entry.entity_id,
+            # "entry_id": entry.entry_id,
+            "version": entry.version,
+            "last_modified": entry.last_modified,
+            "last_modified_by": entry.last_modified_by,
+            "status": entry.status,
+            "message": entry.message,
+            "op": entry.op,
+            "discarded": entry.discarded,
+            "diff": diff,
+            **body_values(entry.body, compress=compress),
+        }
+
+
+def body_values(body: dict, compress: bool = False) -> dict:
+    """
+    The values of the body and body_compressed columns. A None body is stored as JSON null,
+    since the body column is not nullable.
+    """
+    if compress:
+        return {"body": None, "body_compressed": compress_body(body)}
+    return {"body": body, "body_compressed": None}
+
+
+def compress_body(body: dict) -> bytes:
+    return zlib.compress(json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def decompress_body(body_compressed: bytes) -> dict:
+    return json.loads(zlib.decompress(body_compressed))
+
+
+def row_body(row) -> dict:
+    """The body of a history row, no matter how it is stored. Rows stored as deltas are not handled."""
+    if row.body_compressed is not None:
+        return decompress_body(row.body_compressed)
+    return row.body
+
+
+class BaseLatestEntry:
+    """
+    Points out the latest version of each entry in a history table. Kept up to date
+    by EntryRepository.save so that the latest versions can be found without
+    aggregating over the full history.
+    """
+
+    entity_id = Column(ULIDType, primary_key=True)
+    version = Column(Integer, nullable=False)
+
+
+class IndexOutboxModel(Base):
+    """
+    Entries whose latest version has not yet been written to the search index. Rows are added in
+    the same transaction as the entry changes, and removed when the index has been updated.
+    """
+
+    __tablename__ = "index_outbox"
+    id = Column(Integer, primary_key=True)
+    resource_id = Column(String(32), nullable=False)
+    entity_id = Column(ULIDType, nullable=False)
+    created_at = Column(Float(precision=53), nullable=False)
+
+
+class ReindexCheckpointModel(Base):
+    """
+    The progress of an unfinished reindex of a resource, so that it can be resumed. Entries are
+    indexed in id order, so all entries up to last_entity_id are in the new index.
+    """
+
+    __tablename__ = "reindex_checkpoints"
+    resource_id = Column(String(32), primary_key=True)
+    index_name = Column(String(100), nullable=False)
+    last_entity_id = Column(ULIDType, nullable=True)
+    indexed = Column(Integer, nullable=False)
+    # when the reindex started, edits after that are also written to the new index
+    started_at = Column(Float(precision=53), nullable=True)
+
+
+class SearchGenerationModel(Base):
+    """
+    A counter per resource that is increased every time its search index changes, so that cached
+    search results can be recognized as outdated.
+    """
+
+    __tablename__ = "search_generations"
+    resource_id = Column(String(32), primary_key=True)
+    generation = Column(Integer, nullable=False)
 
 
 class ApiKeyModel(Base):
@@ -156,12 +246,45 @@ class ApiKeyModel(Base):
 # Dynamic models
 
 
+def entry_history_indexes(table_name: str) -> tuple[Index, ...]:
+    """
+    Indexes for the queries in EntryRepository. SQLite needs index names to be unique
+    in the whole database, so they are prefixed with the table name.
+    """
+    return (
+        # max(last_modified) and history ordered by last_modified
+        Index(f"{table_name}_lm", "last_modified", "history_id"),
+        # history for a user
+        Index(f"{table_name}_lmb", "last_modified_by", "last_modified", "history_id"),
+        # latest (non-)discarded entries modified since a given time
+        Index(f"{table_name}_dlm", "discarded", "last_modified"),
+    )
+
+
 @functools.cache
 def get_or_create_entry_history_model(
     resource_id: str,
 ) -> BaseHistoryEntry:
     attributes = {
         "__tablename__": resource_id,
+        "__table_args__": BaseHistoryEntry.__table_args__ + entry_history_indexes(resource_id),
     }
 
     return type(resource_id, (Base, BaseHistoryEntry), attributes)
+
+
+def latest_table_name(table_name: str) -> str:
+    # table_name is at most 59 characters (resource_id + "_" + ULID) and
+    # MariaDB allows 64 characters for table names
+    return f"{table_name}_cur"
+
+
+@functools.cache
+def get_or_create_entry_latest_model(
+    table_name: str,
+) -> BaseLatestEntry:
+    attributes = {
+        "__tablename__": latest_table_name(table_name),
+    }
+
+    return type(latest_table_name(table_name), (Base, BaseLatestEntry), attributes)
@@ -0,0 +1,36 @@
+"""Checkpoints that make it possible to resume an interrupted reindex."""
+
+import typing
+
+from sqlalchemy import sql
+
+from karp.foundation.value_objects import UniqueId
+from karp.globals import session
+
+from .models import ReindexCheckpointModel
+
+
+def by_resource_id(resource_id: str) -> typing.Optional[ReindexCheckpointModel]:
+    return session.get(ReindexCheckpointModel, resource_id)
+
+
+def save(
+    resource_id: str,
+    index_name: str,
+    last_entity_id: typing.Optional[UniqueId],
+    indexed: int,
+    started_at: typing.Optional[float],
+):
+    session.merge(
+        ReindexCheckpointModel(
+            resource_id=resource_id,
+            index_name=index_name,
+            last_entity_id=last_entity_id,
+            indexed=indexed,
+            started_at=started_at,
+        )
+    )
+
+
+def remove(resource_id: str):
+    session.execute(sql.delete(ReindexCheckpointModel).where(ReindexCheckpointModel.resource_id == resource_id))
@@ -0,0 +1,42 @@
+"""
+A generation counter per resource, increased whenever the search index of the resource changes.
+Cached search results are stored together with the generations they were computed for.
+"""
+
+import typing
+
+from sqlalchemy import sql
+from sqlalchemy.dialects import mysql, sqlite
+
+from karp.globals import session
+
+from .models import SearchGenerationModel
+
+
+def get_all() -> dict[str, int]:
+    """The current generation of each resource, resources that are missing are at generation 0."""
+    stmt = sql.select(SearchGenerationModel.resource_id, SearchGenerationModel.generation)
+    return dict(session.execute(stmt).tuples())
+
+
+def bump(resource_ids: typing.Iterable[str]):
+    """Increase the generation of the given resources. Takes effect when the session is committed."""
+    # in a fixed order, so that two transactions that bump the same resources do not deadlock
+    for resource_id in sorted(set(resource_ids)):
+        session.execute(_upsert(resource_id))
+
+
+def _upsert(resource_id: str):
+    """Insert the resource at generation 1, or increase its generation if it is already there."""
+    next_generation = SearchGenerationModel.generation + 1
+    if session.get_bind().dialect.name == "sqlite":
+        return (
+            sqlite.insert(SearchGenerationModel)
+            .values(resource_id=resource_id, generation=1)
+            .on_conflict_do_update(index_elements=["resource_id"], set_={"generation": next_generation})
+        )
+    return (
+        mysql.insert(SearchGenerationModel)
+        .values(resource_id=resource_id, generation=1)
+        .on_duplicate_key_update(generation=next_generation)
+    )
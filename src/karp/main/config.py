@@ -1,4 +1,5 @@
 import os
+import re
 from typing import Callable
 
 from sqlalchemy.engine import URL as DatabaseUrl
@@ -94,3 +95,45 @@ env = load_env()
 
 DATABASE_URL = parse_database_url(env)
 DATABASE_NAME = parse_database_name(env)
+
+# if "false", edits made through the API do not wait for the search index to be updated,
+# instead "karp-cli entries index-worker" should be running
+WAIT_FOR_INDEX = env("WAIT_FOR_INDEX", "true").lower() != "false"
+
+# the default refresh policy for the search indices, see refresh_policy in the resource config
+INDEX_REFRESH_POLICY = env("INDEX_REFRESH_POLICY", "immediate")
+# the same values as ResourceConfig.refresh_policy
+if not re.fullmatch(r"immediate|wait_for|none|\d+(ms|s)", INDEX_REFRESH_POLICY):
+    raise ValueError(
+        "INDEX_REFRESH_POLICY must be 'immediate', 'wait_for', 'none' or an interval such as '500ms' or '5s',"
+        f" not {INDEX_REFRESH_POLICY!r}"
+    )
+
+# bulk requests to the search index are sent in chunks of at most this many entries and bytes
+INDEX_BULK_CHUNK_SIZE = env.int("INDEX_BULK_CHUNK_SIZE", 500)
+INDEX_BULK_MAX_CHUNK_BYTES = env.int("INDEX_BULK_MAX_CHUNK_BYTES", 100 * 1024 * 1024)
+# the number of chunks that are sent at the same time when many entries are indexed, e.g. by reindex
+INDEX_BULK_THREADS = env.int("INDEX_BULK_THREADS", 1)
+# how many times a chunk is retried, with exponential backoff, when OpenSearch is overloaded (429)
+INDEX_BULK_MAX_RETRIES = env.int("INDEX_BULK_MAX_RETRIES", 5)
+# if "false", reindex does not merge the new index into one segment before it is used. Otherwise,
+# how many seconds to wait for the merge
+INDEX_FORCE_MERGE = env("INDEX_FORCE_MERGE", "true").lower() != "false"
+INDEX_FORCE_MERGE_TIMEOUT = env.int("INDEX_FORCE_MERGE_TIMEOUT", 24 * 60 * 60)
+
+# the number of parsed queries that are kept in memory, see search_service.parse_query
+QUERY_PARSE_CACHE_SIZE = env.int("QUERY_PARSE_CACHE_SIZE", 1024)
+# the number of queries that are kept in memory as OpenSearch query bodies, see search_service.compile_query
+QUERY_COMPILE_CACHE_SIZE = env.int("QUERY_COMPILE_CACHE_SIZE", 1024)
+# the number of responses from /query and /query/stats that are kept in memory (0 turns this off),
+# and for how many seconds, see lex.application.search_queries. The responses are also dropped
+# when the resources are changed, but edits that are not refreshed right away (see
+# INDEX_REFRESH_POLICY) may take this long to show up.
+QUERY_RESULT_CACHE_SIZE = env.int("QUERY_RESULT_CACHE_SIZE", 256)
+QUERY_RESULT_CACHE_TTL = env.int("QUERY_RESULT_CACHE_TTL", 60)
+# how long OpenSearch keeps the point in time of a /query cursor between two pages
+QUERY_CURSOR_KEEP_ALIVE = env("QUERY_CURSOR_KEEP_ALIVE", "5m")
+# "fast" for the hand-written query parser or "tatsu" for the one generated from grammars/query.ebnf
+QUERY_PARSER = env("QUERY_PARSER", "fast")
+if QUERY_PARSER not in ("fast", "tatsu"):
+    raise ValueError(f"QUERY_PARSER must be 'fast' or 'tatsu', not {QUERY_PARSER!r}")
@@ -13,6 +13,7 @@ class ClientErrorCodes(enum.IntEnum):
     SORT_ERROR = 82
     INCOMPATIBLE_RESOURCES = 83
     FIELD_DOES_NOT_EXIST = 84
+    INVALID_CURSOR = 85
 
 
 class KarpError(Exception):
@@ -73,3 +74,11 @@ class IncompatibleResources(UserError):
             message=f'Resources have different settings for field: "{field}"',
             code=ClientErrorCodes.INCOMPATIBLE_RESOURCES,
         )
+
+
+class InvalidCursor(UserError):
+    def __init__(self):
+        super().__init__(
+            message="The cursor is invalid or has expired, start again with cursor=*",
+            code=ClientErrorCodes.INVALID_CURSOR,
+        )
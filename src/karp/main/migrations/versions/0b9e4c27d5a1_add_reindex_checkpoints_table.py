@@ -0,0 +1,34 @@
+"""add reindex_checkpoints table
+
+Revision ID: 0b9e4c27d5a1
+Revises: c3d7e1f0a958
+Create Date: 2026-10-18 15:11:38.204716
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from karp.db_infrastructure.types import ULIDType
+
+# revision identifiers, used by Alembic.
+revision = "0b9e4c27d5a1"
+down_revision = "c3d7e1f0a958"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "reindex_checkpoints",
+        sa.Column("resource_id", sa.String(length=32), nullable=False),
+        sa.Column("index_name", sa.String(length=100), nullable=False),
+        sa.Column("last_entity_id", ULIDType, nullable=True),
+        sa.Column("indexed", sa.Integer(), nullable=False),
+        sa.Column("started_at", sa.Float(precision=53), nullable=True),
+        sa.PrimaryKeyConstraint("resource_id"),
+    )
+
+
+def downgrade():
+    op.drop_table("reindex_checkpoints")
@@ -0,0 +1,39 @@
+"""Add a column for compressed entry bodies to the entry tables.
+It is used for resources with compressBody set in their config.
+
+Revision ID: 2f61c8d9a7b3
+Revises: 8cdb11a0464d
+Create Date: 2026-10-18 12:31:05.418220
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects.mysql import LONGBLOB
+
+# revision identifiers, used by Alembic.
+revision = "2f61c8d9a7b3"
+down_revision = "8cdb11a0464d"
+branch_labels = None
+depends_on = None
+
+
+def _entry_tables():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    table_names = conn.execute(sa.text("SELECT DISTINCT table_name FROM resources")).scalars()
+    return [table_name for table_name in table_names if inspector.has_table(table_name)]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table_name in _entry_tables():
+        # tables created by a newer version of Karp already have the column
+        if "body_compressed" in {column["name"] for column in inspector.get_columns(table_name)}:
+            continue
+        op.add_column(table_name, sa.Column("body_compressed", LONGBLOB(), nullable=True))
+
+
+def downgrade():
+    for table_name in _entry_tables():
+        op.drop_column(table_name, "body_compressed")
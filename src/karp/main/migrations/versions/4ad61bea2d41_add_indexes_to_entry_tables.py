@@ -0,0 +1,47 @@
+"""Add indexes on last_modified, last_modified_by and discarded to the entry tables.
+
+Revision ID: 4ad61bea2d41
+Revises: 993551c86272
+Create Date: 2026-10-18 11:02:17.560391
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "4ad61bea2d41"
+down_revision = "993551c86272"
+branch_labels = None
+depends_on = None
+
+
+def _entry_tables():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    table_names = conn.execute(sa.text("SELECT DISTINCT table_name FROM resources")).scalars()
+    return [table_name for table_name in table_names if inspector.has_table(table_name)]
+
+
+def _indexes(table_name):
+    return [
+        (f"{table_name}_lm", ["last_modified", "history_id"]),
+        (f"{table_name}_lmb", ["last_modified_by", "last_modified", "history_id"]),
+        (f"{table_name}_dlm", ["discarded", "last_modified"]),
+    ]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table_name in _entry_tables():
+        # tables created by a newer version of Karp already have the indexes
+        existing = {index["name"] for index in inspector.get_indexes(table_name)}
+        for index_name, columns in _indexes(table_name):
+            if index_name not in existing:
+                op.create_index(index_name, table_name, columns)
+
+
+def downgrade():
+    for table_name in _entry_tables():
+        for index_name, _ in _indexes(table_name):
+            op.drop_index(index_name, table_name=table_name)
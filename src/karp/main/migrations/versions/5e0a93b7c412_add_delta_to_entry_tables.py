@@ -0,0 +1,38 @@
+"""Add a column for versions stored as deltas to the entry tables.
+It is used for resources with snapshotInterval set in their config.
+
+Revision ID: 5e0a93b7c412
+Revises: 2f61c8d9a7b3
+Create Date: 2026-10-18 13:20:44.907316
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5e0a93b7c412"
+down_revision = "2f61c8d9a7b3"
+branch_labels = None
+depends_on = None
+
+
+def _entry_tables():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    table_names = conn.execute(sa.text("SELECT DISTINCT table_name FROM resources")).scalars()
+    return [table_name for table_name in table_names if inspector.has_table(table_name)]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table_name in _entry_tables():
+        # tables created by a newer version of Karp already have the column
+        if "delta" in {column["name"] for column in inspector.get_columns(table_name)}:
+            continue
+        op.add_column(table_name, sa.Column("delta", sa.JSON(), nullable=True))
+
+
+def downgrade():
+    for table_name in _entry_tables():
+        op.drop_column(table_name, "delta")
@@ -0,0 +1,29 @@
+"""add search_generations table
+
+Revision ID: 5e81f3a2c6d4
+Revises: 0b9e4c27d5a1
+Create Date: 2026-10-18 17:42:09.518362
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5e81f3a2c6d4"
+down_revision = "0b9e4c27d5a1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "search_generations",
+        sa.Column("resource_id", sa.String(length=32), nullable=False),
+        sa.Column("generation", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("resource_id"),
+    )
+
+
+def downgrade():
+    op.drop_table("search_generations")
@@ -0,0 +1,81 @@
+"""Store the diff against the previous version in the entry tables.
+Previously the diffs were computed for every history request.
+
+Revision ID: 8cdb11a0464d
+Revises: 4ad61bea2d41
+Create Date: 2026-10-18 11:48:53.021744
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sb_json_tools import jsondiff
+
+# revision identifiers, used by Alembic.
+revision = "8cdb11a0464d"
+down_revision = "4ad61bea2d41"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def _entry_tables():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    table_names = conn.execute(sa.text("SELECT DISTINCT table_name FROM resources")).scalars()
+    return [table_name for table_name in table_names if inspector.has_table(table_name)]
+
+
+def _backfill_diffs(table_name):
+    conn = op.get_bind()
+    table = sa.table(
+        table_name,
+        sa.column("history_id", sa.Integer),
+        sa.column("entity_id", sa.String),
+        sa.column("version", sa.Integer),
+        sa.column("body", sa.JSON),
+        sa.column("diff", sa.JSON),
+    )
+    update = (
+        table.update().where(table.c.history_id == sa.bindparam("b_history_id")).values(diff=sa.bindparam("b_diff"))
+    )
+
+    # go through all versions of each entry in order, BATCH_SIZE rows at a time
+    previous_entity_id, previous_version, previous_body = None, None, {}
+    while True:
+        stmt = sa.select(table.c.history_id, table.c.entity_id, table.c.version, table.c.body)
+        if previous_entity_id is not None:
+            stmt = stmt.where(
+                sa.or_(
+                    table.c.entity_id > previous_entity_id,
+                    sa.and_(table.c.entity_id == previous_entity_id, table.c.version > previous_version),
+                )
+            )
+        stmt = stmt.order_by(table.c.entity_id, table.c.version).limit(BATCH_SIZE)
+        rows = conn.execute(stmt).all()
+        if not rows:
+            break
+
+        updates = []
+        for history_id, entity_id, version, body in rows:
+            if entity_id != previous_entity_id:
+                previous_body = {}
+            updates.append({"b_history_id": history_id, "b_diff": jsondiff.compare(previous_body, body)})
+            previous_entity_id, previous_version, previous_body = entity_id, version, body
+        conn.execute(update, updates)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table_name in _entry_tables():
+        # tables created by a newer version of Karp already have the column
+        if "diff" in {column["name"] for column in inspector.get_columns(table_name)}:
+            continue
+        op.add_column(table_name, sa.Column("diff", sa.JSON(), nullable=True))
+        _backfill_diffs(table_name)
+
+
+def downgrade():
+    for table_name in _entry_tables():
+        op.drop_column(table_name, "diff")
@@ -0,0 +1,60 @@
+"""Add a table per resource that points out the latest version of each entry.
+Previously the latest versions were found by grouping over the full history.
+
+Revision ID: 993551c86272
+Revises: 1022e239ee16
+Create Date: 2026-10-18 10:12:41.113204
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from karp.db_infrastructure.types import ULIDType
+
+# revision identifiers, used by Alembic.
+revision = "993551c86272"
+down_revision = "1022e239ee16"
+branch_labels = None
+depends_on = None
+
+
+def _entry_tables():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    table_names = conn.execute(sa.text("SELECT DISTINCT table_name FROM resources")).scalars()
+    return [table_name for table_name in table_names if inspector.has_table(table_name)]
+
+
+def backfill(table_name: str, latest_table_name: str):
+    """An INSERT that points out the latest version of each entry in table_name."""
+    history = sa.table(table_name, sa.column("entity_id"), sa.column("version"))
+    latest = sa.table(latest_table_name, sa.column("entity_id"), sa.column("version"))
+    # versions are increasing for each entry, so the max version is the latest one
+    return latest.insert().from_select(
+        ["entity_id", "version"],
+        sa.select(history.c.entity_id, sa.func.max(history.c.version)).group_by(history.c.entity_id),
+    )
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table_name in _entry_tables():
+        latest_table_name = f"{table_name}_cur"
+        # resources created by a newer version of Karp already have the table, and it is up to date
+        if inspector.has_table(latest_table_name):
+            continue
+        op.create_table(
+            latest_table_name,
+            sa.Column("entity_id", ULIDType, nullable=False),
+            sa.Column("version", sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint("entity_id"),
+        )
+        op.execute(backfill(table_name, latest_table_name))
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table_name in _entry_tables():
+        if inspector.has_table(f"{table_name}_cur"):
+            op.drop_table(f"{table_name}_cur")
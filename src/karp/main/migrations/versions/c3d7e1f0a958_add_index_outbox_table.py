@@ -0,0 +1,33 @@
+"""add index_outbox table
+
+Revision ID: c3d7e1f0a958
+Revises: 5e0a93b7c412
+Create Date: 2026-10-18 14:02:51.733290
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from karp.db_infrastructure.types import ULIDType
+
+# revision identifiers, used by Alembic.
+revision = "c3d7e1f0a958"
+down_revision = "5e0a93b7c412"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "index_outbox",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("resource_id", sa.String(length=32), nullable=False),
+        sa.Column("entity_id", ULIDType, nullable=False),
+        sa.Column("created_at", sa.Float(precision=53), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def downgrade():
+    op.drop_table("index_outbox")
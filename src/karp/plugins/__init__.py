@@ -6,6 +6,7 @@ from .plugin import (
     ExpansionPhases,
     Plugin,
     expansion_phases,
+    find_virtual_fields,
     register_plugin,
     transform,
     transform_config,
@@ -23,6 +24,7 @@ __all__ = [
     EXPANDED,
     INDEXED,
     UNEXPANDED,
+    "find_virtual_fields",
     "register_plugin",
     "transform",
     "transform_list",
@@ -20,6 +20,7 @@ from karp.foundation.json import (
     localise_path,
     make_path,
     path_str,
+    paths_overlap,
     set_path,
 )
 from karp.lex.domain.dtos import EntryDto, ResourceDto
@@ -328,10 +329,14 @@ def transform_list(
     bodies: list[Dict],
     cached_results: Optional[Dict] = None,
     expand_plugins: bool | ExpansionPhase | ExpansionPhases = True,
+    fields: Optional[Iterable[str]] = None,
 ) -> list[Dict]:
     """
     Given a list of entry bodies, calculate all the virtual fields.
 
+    If fields is given, only the virtual fields that are needed for these fields (for example
+    "baseform" or "inflection.wordforms") are calculated.
+
     cached_results is an optional parameter which allows for caching plugin
     results across multiple calls to transform_list. Use it like this:
 
@@ -465,6 +470,20 @@ def transform_list(
     except CycleError as e:
         raise PluginException(f"virtual fields form a cycle: {e.args[1]}") from None
 
+    if fields is not None:
+        # the virtual fields inside, or containing, one of the fields, and what they depend on
+        field_paths = [make_path(field) for field in fields]
+        needed = {
+            field_name for field_name in dependencies if any(paths_overlap(field_name, path) for path in field_paths)
+        }
+        todo = list(needed)
+        while todo:
+            for dependency in dependencies.get(todo.pop(), ()):
+                if dependency not in needed:
+                    needed.add(dependency)
+                    todo.append(dependency)
+        order = [field_name for field_name in order if field_name in needed]
+
     # Expand each field in turn
     for field_name in order:
         field_path = make_path(field_name)
@@ -1,12 +1,12 @@
 import logging
 
-from karp import plugins
+from karp import plugins, search_commands
 from karp.foundation.timings import utc_now
 from karp.globals import session
 from karp.lex.domain import entities, errors
 from karp.lex.domain.dtos import ResourceDto
 from karp.lex.domain.errors import IntegrityError, ResourceNotFound
-from karp.lex.infrastructure.sql import resource_repository
+from karp.lex.infrastructure.sql import resource_repository, search_generations
 from karp.main.errors import KarpError
 from karp.search.infrastructure.opensearch import indices as es_index
 
@@ -35,6 +35,7 @@ def create_resource(config, user):
     resource_repository.save(resource)
     config = plugins.transform_config(resource.config, expand_plugins=plugins.INDEXED)
     es_index.create_index(resource.resource_id, config)
+    search_generations.bump([resource_id])
     session.commit()
     return ResourceDto.from_resource(resource)
 
@@ -50,7 +51,11 @@ def update_resource(resource_id, version, config, message, user):
     )
     if updated:
         resource_repository.save(resource)
+        # the plugins that are expanded in search results may have changed
+        search_generations.bump([resource_id])
     session.commit()
+    if updated:
+        es_index.update_refresh_policy(resource_id, resource.config)
 
 
 def publish_resource(resource_id, message, user, version):
@@ -65,6 +70,7 @@ def publish_resource(resource_id, message, user, version):
         version=version,
     )
     resource_repository.save(resource)
+    search_generations.bump([resource_id])
     session.commit()
 
 
@@ -75,6 +81,7 @@ def unpublish_resource(resource_id, user, version, keep_index=False):
         return False
     resource.unpublish(user=user, version=version)
     resource_repository.save(resource)
+    search_generations.bump([resource_id])
     session.commit()
     if not keep_index:
         es_index.delete_index(resource_id)
@@ -88,6 +95,8 @@ def delete_resource(resource_id):
 
     # delete the index with alias "resource_id" from Elasticsearch
     es_index.delete_index(resource_id)
+    # and the new index of an interrupted reindex
+    search_commands.abort_reindex(resource_id)
 
     # drop resource table
     resource = resource_repository.by_resource_id(resource_id)
@@ -95,5 +104,16 @@ def delete_resource(resource_id):
 
     # delete all rows from resource table associated with resource_id
     resource_repository.delete_all_versions(resource_id)
+    search_generations.bump([resource_id])
     session.commit()
     return True
+
+
+def convert_storage(resource_id, batch_size=1000):
+    """
+    Store the entries of the resource according to compress_body and snapshot_interval in its config.
+    Commits after each batch, so it can be interrupted and run again.
+    """
+    entries = resource_repository.entries_by_resource_id(resource_id)
+    for _ in entries.convert_storage(batch_size=batch_size):
+        session.commit()
@@ -0,0 +1,234 @@
+"""
+A hand-written parser for the Karp query DSL (grammars/query.ebnf).
+
+It gives the same karp_query_model nodes as the generated KarpQueryParser, but avoids the generic
+TatSu machinery (memoization, exceptions for backtracking, CST bookkeeping). It follows the PEG
+semantics of the grammar exactly: ordered choice, whitespace skipped before every rule and token,
+and tokens that are words must not be followed by a letter or digit (TatSu's "nameguard").
+Like TatSu, it memoizes the results of expression, since e.g. "and(" is parsed again as a sub query
+when the logical expression fails, which would otherwise take exponential time on nested input.
+
+Invalid queries are parsed again with KarpQueryParser, so that the same FailedParse errors are raised.
+"""
+
+import re
+
+from karp.search.domain.query_dsl.karp_query_model import (
+    And,
+    AnyArgExpression,
+    FieldQuery,
+    Freetext,
+    Identifier,
+    KarpQueryModelBuilderSemantics,
+    ModelBase,
+    Not,
+    Or,
+    QuotedStringValue,
+    StringValue,
+    SubQuery,
+    TextArgExpression,
+)
+from karp.search.domain.query_dsl.karp_query_parser import KarpQueryParser
+
+_WHITESPACE = re.compile(r"(?s)\s+")
+_IDENTIFIER = re.compile(r"[^|)(]+")
+_UNQUOTED_STRING = re.compile(r'[^|)("]+')
+# TatSu compiles patterns with re.MULTILINE, so $ also matches before a newline
+_INTEGER = re.compile(r"\d+$", re.MULTILINE)
+_QUOTED_PART = re.compile(r'(?s)\s+|\\"|[^"]')
+
+_FIELD_OPS = ("exists", "missing")
+_TEXT_OPS = ("contains", "endswith", "regexp", "startswith")
+_ANY_OPS = ("equals", "gt", "gte", "lt", "lte")
+
+
+class _Parser:
+    """Each method takes a position and returns (result, new position), or None if it does not match."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.memo: dict[int, tuple | None] = {}
+
+    def skip(self, pos):
+        match = _WHITESPACE.match(self.text, pos)
+        return match.end() if match else pos
+
+    def token(self, pos, token):
+        pos = self.skip(pos)
+        if not self.text.startswith(token, pos):
+            return None
+        end = pos + len(token)
+        if token[0].isalpha() and end < len(self.text) and self.text[end].isalnum():
+            return None
+        return end
+
+    def tokens(self, pos, tokens):
+        for token in tokens:
+            end = self.token(pos, token)
+            if end is not None:
+                return token, end
+        return None
+
+    def pattern(self, pos, regex):
+        match = regex.match(self.text, self.skip(pos))
+        return (match.group(), match.end()) if match else None
+
+    def start(self):
+        result = self.expression(0)
+        if result is None or self.skip(result[1]) != len(self.text):
+            return None
+        return result[0]
+
+    def expression(self, pos):
+        if pos not in self.memo:
+            self.memo[pos] = self.logical_expression(pos) or self.query_expression(pos) or self.sub_query(pos)
+        return self.memo[pos]
+
+    def logical_expression(self, pos):
+        return (
+            self.gather(pos, "and", And, min_count=0)
+            or self.gather(pos, "or", Or, min_count=0)
+            or self.gather(pos, "not", Not, min_count=1)
+        )
+
+    def gather(self, pos, name, node_type, min_count):
+        pos = self.token(pos, name)
+        if pos is None:
+            return None
+        pos = self.token(pos, "(")
+        if pos is None:
+            return None
+
+        expressions = []
+        result = self.expression(pos)
+        while result is not None:
+            expressions.append(result[0])
+            pos = result[1]
+            after_sep = self.token(pos, "||")
+            result = self.expression(after_sep) if after_sep is not None else None
+        if len(expressions) < min_count:
+            return None
+
+        pos = self.token(pos, ")")
+        if pos is None:
+            return None
+        return node_type(ast=expressions), pos
+
+    def query_expression(self, pos):
+        return self.field_query(pos) or self.freetext(pos) or self.text_arg_expr(pos) or self.any_arg_expr(pos)
+
+    def field_query(self, pos):
+        result = self.tokens(self.skip(pos), _FIELD_OPS)
+        if result is None:
+            return None
+        op, pos = result
+        pos = self.token(pos, "|")
+        if pos is None:
+            return None
+        result = self.identifier(pos)
+        if result is None:
+            return None
+        field, pos = result
+        return FieldQuery(ast={"op": op, "field": field}), pos
+
+    def freetext(self, pos):
+        pos = self.token(pos, "freetext")
+        if pos is None:
+            return None
+        pos = self.token(pos, "|")
+        if pos is None:
+            return None
+        result = self.string_value(pos)
+        if result is None:
+            return None
+        arg, pos = result
+        return Freetext(ast={"arg": arg}), pos
+
+    def text_arg_expr(self, pos):
+        return self.binary_expr(pos, _TEXT_OPS, TextArgExpression, self.string_value)
+
+    def any_arg_expr(self, pos):
+        return self.binary_expr(pos, _ANY_OPS, AnyArgExpression, self.any_value)
+
+    def binary_expr(self, pos, ops, node_type, value):
+        result = self.tokens(self.skip(pos), ops)
+        if result is None:
+            return None
+        op, pos = result
+        pos = self.token(pos, "|")
+        if pos is None:
+            return None
+        result = self.identifier(pos)
+        if result is None:
+            return None
+        field, pos = result
+        pos = self.token(pos, "|")
+        if pos is None:
+            return None
+        result = value(pos)
+        if result is None:
+            return None
+        arg, pos = result
+        return node_type(ast={"op": op, "field": field, "arg": arg}), pos
+
+    def sub_query(self, pos):
+        result = self.identifier(pos)
+        if result is None:
+            return None
+        field, pos = result
+        pos = self.token(pos, "(")
+        if pos is None:
+            return None
+        result = self.expression(pos)
+        if result is None:
+            return None
+        exp, pos = result
+        pos = self.token(pos, ")")
+        if pos is None:
+            return None
+        return SubQuery(ast={"field": field, "exp": exp}), pos
+
+    def identifier(self, pos):
+        result = self.pattern(pos, _IDENTIFIER)
+        if result is None:
+            return None
+        return Identifier(ast=result[0]), result[1]
+
+    def any_value(self, pos):
+        result = self.pattern(pos, _INTEGER)
+        if result is not None:
+            return int(result[0]), result[1]
+        return self.string_value(pos)
+
+    def string_value(self, pos):
+        result = self.pattern(pos, _UNQUOTED_STRING) or self.quoted_string_value(pos)
+        if result is None:
+            return None
+        return StringValue(ast=result[0]), result[1]
+
+    def quoted_string_value(self, pos):
+        pos = self.token(pos, '"')
+        if pos is None:
+            return None
+        parts = []
+        while match := _QUOTED_PART.match(self.text, pos):
+            parts.append(match.group())
+            pos = match.end()
+        pos = self.token(pos, '"')
+        if pos is None:
+            return None
+        return QuotedStringValue(ast=parts), pos
+
+
+class KarpQueryFastParser:
+    """Drop-in replacement for KarpQueryParser(semantics=KarpQueryModelBuilderSemantics())."""
+
+    def __init__(self):
+        self._fallback = KarpQueryParser(semantics=KarpQueryModelBuilderSemantics())
+
+    def parse(self, text: str) -> ModelBase:
+        result = _Parser(text).start()
+        if result is None:
+            # raises FailedParse
+            return self._fallback.parse(text)
+        return result
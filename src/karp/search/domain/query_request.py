@@ -17,6 +17,12 @@ class QueryRequest:
     highlight: HighlightParam = field(default_factory=lambda: HighlightParam.false)
     sort: list[str] = field(default_factory=list)
     path: str | None = None
+    # only return these fields of each hit, e.g. ["id", "entry.baseform"], all if empty
+    fields: list[str] = field(default_factory=list)
+    # if not None, only these fields of the entries are fetched from the index (_source includes)
+    source_includes: list[str] | None = None
+    # "*" to start paging with a cursor, or the cursor of the previous page, see search_service.query
+    cursor: str | None = None
 
     def __post_init__(self) -> None:
         # if resources is provided as a comma-separated string, split it.
@@ -1,9 +1,12 @@
+import contextvars
 import logging
 import re
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Any, Iterable
+from itertools import batched
+from typing import Iterable, Iterator
 
 import opensearchpy
 import opensearchpy.helpers
@@ -11,6 +14,7 @@ from opensearchpy.exceptions import NotFoundError
 
 from karp.globals import os_client
 from karp.lex.domain.value_objects import ResourceConfig
+from karp.main import config as karp_config
 from karp.main.errors import KarpError
 from karp.search.domain.index_entry import IndexEntry
 from karp.search.infrastructure.opensearch import mapping_repo
@@ -22,7 +26,8 @@ settings = {
     "index": {"knn": True},
     "number_of_shards": 1,
     "number_of_replicas": 1,
-    # turns off refreshing, needs to be combined with explicitly making refreshes when adding/deleting
+    # turns off refreshing, needs to be combined with explicitly making refreshes when adding/deleting.
+    # overridden by create_index according to the refresh policy of the resource
     "refresh_interval": -1,
     "mapping": {"nested_fields": {"limit": 100}},
     "analysis": {
@@ -69,17 +74,40 @@ settings = {
     },
 }
 
+# used instead of some of the settings above while an index is filled by reindex, see finish_bulk_load
+bulk_load_settings = {
+    "number_of_replicas": 0,
+    "refresh_interval": -1,
+    # flush the translog (which makes a Lucene commit) less often
+    "translog": {"flush_threshold_size": "1gb"},
+    # edits during reindex are written with external versions, and a deleted entry must not be
+    # brought back by an older version read by the reindex. The reindex reads all entries in one
+    # statement, whose versions can be as old as the reindex itself, so deletions are remembered
+    # until finish_bulk_load
+    "gc_deletes": "3650d",
+}
 
-def create_index(resource_id: str, config: ResourceConfig, call_create_alias=True):
+
+def create_index(resource_id: str, config: ResourceConfig, call_create_alias=True, bulk_load=False):
+    """
+    Create a new index for the resource. If bulk_load is True, the index is created with settings for
+    fast bulk indexing: no replicas, no refreshes and less frequent translog flushes. Call
+    finish_bulk_load when done.
+    """
     logger.info("creating es mapping")
     mapping = _create_es_mapping(config)
 
     properties = mapping["properties"]
     for field in mapping_repo.internal_fields.values():
         properties[field.name] = {"type": field.type}
+    # marks that the entry versions are used as external versions, see mapping_repo.has_external_versions
+    mapping["_meta"] = {"external_versions": True}
 
+    index_settings = {**settings, "refresh_interval": refresh_interval(refresh_policy(config))}
+    if bulk_load:
+        index_settings.update(bulk_load_settings)
     body = {
-        "settings": settings,
+        "settings": index_settings,
         "mappings": mapping,
     }
 
@@ -102,6 +130,33 @@ def create_index(resource_id: str, config: ResourceConfig, call_create_alias=Tru
     return index_name
 
 
+def finish_bulk_load(index_name: str, config: ResourceConfig):
+    """
+    Prepare an index created with bulk_load=True for use: refresh it, merge it into one segment
+    (unless INDEX_FORCE_MERGE is false) and restore the normal settings. The replicas are then
+    copied from the merged index.
+    """
+    refresh_index(index_name)
+    if karp_config.INDEX_FORCE_MERGE:
+        logger.info("Force merging index %s", index_name)
+        # merging a large index can take much longer than the usual request timeout
+        os_client.indices.forcemerge(
+            index=index_name, max_num_segments=1, request_timeout=karp_config.INDEX_FORCE_MERGE_TIMEOUT
+        )
+    os_client.indices.put_settings(
+        index=index_name,
+        body={
+            "index": {
+                "number_of_replicas": settings["number_of_replicas"],
+                "refresh_interval": refresh_interval(refresh_policy(config)),
+                # reset to the defaults
+                "translog.flush_threshold_size": None,
+                "gc_deletes": None,
+            }
+        },
+    )
+
+
 def create_alias(resource_id, index_name):
     if os_client.indices.exists_alias(name=resource_id):
         os_client.indices.delete_alias(name=resource_id, index="*")
@@ -112,6 +167,41 @@ def refresh_index(index_name: str):
     os_client.indices.refresh(index=index_name)
 
 
+def refresh_policy(config: ResourceConfig) -> str:
+    """
+    How edits are made searchable: "immediate", "wait_for", "none" or an interval for periodic
+    refreshes, see ResourceConfig.refresh_policy.
+    """
+    return config.refresh_policy or karp_config.INDEX_REFRESH_POLICY
+
+
+def refresh_interval(policy: str) -> str | int:
+    """The refresh_interval index setting for a refresh policy."""
+    if policy in ("immediate", "none"):
+        # refreshes are made explicitly, if at all
+        return -1
+    if policy == "wait_for":
+        # wait_for needs scheduled refreshes to return, use the OpenSearch default
+        return "1s"
+    return policy
+
+
+def refresh_after_write(resource_id: str, policy: str):
+    """Call after adding or deleting entries in a resource, unless refresh="wait_for" was used."""
+    if policy == "immediate":
+        refresh_index(resource_id)
+
+
+def update_refresh_policy(resource_id: str, config: ResourceConfig):
+    """Update the index of a resource after its refresh policy is changed."""
+    try:
+        os_client.indices.put_settings(
+            index=resource_id, body={"index": {"refresh_interval": refresh_interval(refresh_policy(config))}}
+        )
+    except NotFoundError:
+        pass
+
+
 def delete_index(resource_id: str):
     try:
         index_name = os_client.indices.get_alias(name=resource_id).popitem()[0]
@@ -120,57 +210,162 @@ def delete_index(resource_id: str):
         pass
 
 
-def add_entries(resource_id: str, entries: Iterable[IndexEntry]):
+def delete_index_by_name(index_name: str):
+    """Delete an index that may not have an alias, such as the new index of a reindex."""
+    try:
+        os_client.indices.delete(index=index_name)
+    except NotFoundError:
+        pass
+
+
+def add_entries(resource_id: str, entries: Iterable[IndexEntry], versioned=False):
     """
     Add entries using OpenSearch bulk edit API.
 
     Does not refresh, do it manually with refresh_index.
     """
-    gen = add_entries_gen(resource_id, entries)
+    gen = add_entries_gen(resource_id, entries, versioned=versioned)
     # exhaust the generator before returning
     list(gen)
 
 
-def add_entries_gen(resource_id: str, entries: Iterable[IndexEntry]):
+def add_entries_gen(
+    resource_id: str,
+    entries: Iterable[IndexEntry],
+    chunk_size: int | None = None,
+    max_chunk_bytes: int | None = None,
+    thread_count: int | None = None,
+    versioned=False,
+):
     """
     Add entries using OpenSearch bulk edit API.
 
-    Returns a generator that must be exhausted to make all edits happen.
+    Returns a generator that must be exhausted to make all edits happen. It yields the id of
+    each added entry, in the same order as entries.
+
+    If versioned is True, entries are only written if they are not older than the version in the
+    index, see index_action. Skipped entries are also yielded.
+
+    The entries are sent in chunks of at most chunk_size entries and max_chunk_bytes bytes, with
+    thread_count chunks sent at the same time. The defaults are INDEX_BULK_CHUNK_SIZE,
+    INDEX_BULK_MAX_CHUNK_BYTES and INDEX_BULK_THREADS.
 
     Does not refresh, do it manually with refresh_index.
     """
-    index_to_es = (
-        {
-            "_index": resource_id,
-            "_id": entry.id,
-            "_source": entry.entry,
-        }
-        for entry in entries
-    )
+    index_to_es = (index_action(resource_id, entry, versioned=versioned) for entry in entries)
 
     try:
-        for _ in opensearchpy.helpers.streaming_bulk(os_client, index_to_es, refresh=False):
-            yield
+        for _, item in _streaming_bulk(
+            index_to_es,
+            thread_count=thread_count or karp_config.INDEX_BULK_THREADS,
+            refresh=False,
+            ignore_status=(409,) if versioned else (),
+            **_chunk_options(chunk_size, max_chunk_bytes),
+        ):
+            yield item["index"]["_id"]
     except opensearchpy.helpers.BulkIndexError as e:
         message = [
             "Error inserting data into Elasticsearch. The following errors occured (terminated at 400 characters):"
         ]
         for error in e.errors:
             message.append(str(error["index"])[0:400])
-            raise KarpError("\n".join(message)) from None
+        raise KarpError("\n".join(message)) from None
 
 
-def delete_entries(resource_id: str, *, entry_ids: Iterable[str], raise_on_error=True) -> dict[str, Any]:
-    index_to_es = (
-        {
-            "_op_type": "delete",
-            "_index": resource_id,
-            "_id": str(entry_id),
-        }
-        for entry_id in entry_ids
-    )
-    _, errors = opensearchpy.helpers.bulk(os_client, index_to_es, refresh=True, raise_on_error=raise_on_error)
-    return [error["delete"] for error in errors]
+def _chunk_options(chunk_size: int | None = None, max_chunk_bytes: int | None = None) -> dict:
+    return {
+        "chunk_size": chunk_size or karp_config.INDEX_BULK_CHUNK_SIZE,
+        "max_chunk_bytes": max_chunk_bytes or karp_config.INDEX_BULK_MAX_CHUNK_BYTES,
+        # chunks rejected with 429 Too Many Requests are retried with exponential backoff
+        "max_retries": karp_config.INDEX_BULK_MAX_RETRIES,
+    }
+
+
+def _streaming_bulk(actions: Iterable[dict], thread_count: int = 1, **kwargs) -> Iterator[tuple[bool, dict]]:
+    """
+    Like opensearchpy.helpers.streaming_bulk, but if thread_count > 1, that many chunks are sent at
+    the same time. Unlike opensearchpy.helpers.parallel_bulk, rejected chunks are retried and at most
+    2 * thread_count chunks are read ahead. The results are in the same order as actions.
+    """
+    if thread_count <= 1:
+        yield from opensearchpy.helpers.streaming_bulk(os_client, actions, **kwargs)
+        return
+
+    def send(chunk):
+        # streaming_bulk splits the chunk further if it is larger than max_chunk_bytes
+        return list(opensearchpy.helpers.streaming_bulk(os_client, chunk, **kwargs))
+
+    with ThreadPoolExecutor(max_workers=thread_count) as executor:
+        pending = deque()
+        for chunk in batched(actions, kwargs["chunk_size"]):
+            # os_client is a context variable, so run in a copy of this context
+            pending.append(executor.submit(contextvars.copy_context().run, send, chunk))
+            if len(pending) >= 2 * thread_count:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def index_action(resource_id: str, entry: IndexEntry, versioned=False) -> dict:
+    """
+    If versioned is True, the entry version is used as external version, so that the action fails
+    with a version conflict (409) if a later version of the entry is in the index.
+    """
+    action = {
+        "_index": resource_id,
+        "_id": entry.id,
+        "_source": entry.entry,
+    }
+    if versioned:
+        action["version"] = entry.entry[mapping_repo.internal_fields["version"].name]
+        action["version_type"] = "external_gte"
+    return action
+
+
+def delete_action(resource_id: str, entry_id: str, version: int | None = None) -> dict:
+    """If version is given, it is used as external version, see index_action."""
+    action = {
+        "_op_type": "delete",
+        "_index": resource_id,
+        "_id": str(entry_id),
+    }
+    if version is not None:
+        action["version"] = version
+        action["version_type"] = "external_gte"
+    return action
+
+
+def bulk(actions: Iterable[dict], refresh: bool | str = False):
+    """
+    Run index and delete actions (see index_action and delete_action), possibly for several
+    resources, using one streaming bulk request. Deleting an entry that is not in the index
+    is not an error, and neither is a version conflict for a versioned action, which means that
+    a later version of the entry is already in the index. The conflicts are logged.
+
+    Unless refresh is given, does not refresh, do it manually with refresh_index.
+    """
+    errors = []
+    for ok, item in opensearchpy.helpers.streaming_bulk(
+        os_client, actions, refresh=refresh, raise_on_error=False, **_chunk_options()
+    ):
+        if not ok:
+            [(op_type, result)] = item.items()
+            status = result.get("status")
+            if status == 409:
+                logger.info(
+                    "Skipped %s of entry %s in %s, the index has a later version",
+                    op_type,
+                    result.get("_id"),
+                    result.get("_index"),
+                )
+            elif op_type != "delete" or status != 404:
+                errors.append(result)
+    if errors:
+        message = [
+            "Error inserting data into Elasticsearch. The following errors occured (terminated at 400 characters):"
+        ]
+        message.extend(str(error)[0:400] for error in errors)
+        raise KarpError("\n".join(message))
 
 
 @dataclass
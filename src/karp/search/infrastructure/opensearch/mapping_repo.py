@@ -2,6 +2,7 @@
 import functools
 import logging
 import re
+import time
 from dataclasses import dataclass
 from itertools import groupby
 from typing import Any, Iterable
@@ -54,6 +55,11 @@ class Field:
         return None
 
 
+# how often (in seconds) get_mappings_key checks if the aliases have changed
+MAPPINGS_KEY_TTL = 10
+# (when it was read, mappings key)
+_mappings_key: tuple[float, tuple[tuple[str, str], ...]] | None = None
+
 # these fields are searchable using the keys as identifiers, prefixed by "@"
 internal_fields = {
     "last_modified_by": Field(path=["_last_modified_by"], type="keyword"),
@@ -158,6 +164,54 @@ def get_field(resource_ids: tuple[str, ...], field_name: str, allow_missing: boo
     return fields[0]
 
 
+def get_mappings_key() -> tuple[tuple[str, str], ...]:
+    """
+    Identifies the mappings that the other functions in this module use: the index behind each
+    alias. Every mapping change is done by reindexing to a new index, so things that are computed
+    from the mappings can be cached with this as part of the key.
+
+    The aliases are read again at most every MAPPINGS_KEY_TTL seconds. If they have changed, e.g.
+    because a resource was reindexed by another process, the caches in this module are cleared.
+    """
+    global _mappings_key
+    now = time.monotonic()
+    if _mappings_key is None or now - _mappings_key[0] > MAPPINGS_KEY_TTL:
+        key = tuple(_read_aliases())
+        if key != tuple(_get_all_aliases()):
+            logger.info("The search indices have changed, clearing cached mappings")
+            clear_caches()
+        _mappings_key = (now, key)
+    return _mappings_key[1]
+
+
+def clear_caches():
+    """Forget everything that is cached in this module, it is read again from OpenSearch when needed."""
+    global _mappings_key
+    _mappings_key = None
+    for value in list(globals().values()):
+        if cache_clear := getattr(value, "cache_clear", None):
+            cache_clear()
+
+
+def has_external_versions(resource_id: str) -> bool:
+    """
+    True if the entry versions are used as external versions in the index of the resource, which is
+    the case for indices made by indices.create_index. Indices made by older versions of Karp have
+    internal versions that can be higher than the entry versions, so versioned writes to them would
+    be rejected. Those indices are written to without versions until the resource is reindexed.
+    """
+    # clears the cache if the resource has been reindexed
+    get_mappings_key()
+    return bool(_get_index_meta().get(resource_id, {}).get("external_versions"))
+
+
+@functools.cache
+def _get_index_meta() -> dict[str, dict[str, Any]]:
+    """The _meta of the mapping of the index behind each alias."""
+    mapping: dict[str, dict[str, Any]] = os_client.indices.get_mapping(filter_path="*.mappings._meta")
+    return {alias: mapping.get(index, {}).get("mappings", {}).get("_meta", {}) for alias, index in _get_all_aliases()}
+
+
 @functools.cache
 def get_reverse_aliases():
     aliases = _get_all_aliases()
@@ -216,6 +270,10 @@ def _get_all_aliases() -> list[tuple[str, str]]:
     """
     :return: a list of tuples (alias_name, index_name)
     """
+    return _read_aliases()
+
+
+def _read_aliases() -> list[tuple[str, str]]:
     result = os_client.cat.aliases(h="alias,index")
     logger.debug(f"{result}")
     index_names: list[tuple[str, str]] = []
@@ -1,8 +1,14 @@
+import base64
+import binascii
+import dataclasses
+import functools
+import itertools
+import json
 import logging
 import re
 import uuid
 from collections import defaultdict
-from typing import Iterable
+from typing import Iterable, Iterator
 
 import opensearchpy
 from tatsu import exceptions as tatsu_exc
@@ -11,9 +17,11 @@ from tatsu.walkers import NodeWalker
 import karp.search.infrastructure.opensearch.mapping_repo as mapping_repo
 from karp.foundation.json import get_path
 from karp.globals import os_client
-from karp.main.errors import KarpError, QueryParserError
+from karp.main import config as karp_config
+from karp.main.errors import InvalidCursor, KarpError, QueryParserError
 from karp.search.domain import QueryRequest
 from karp.search.domain.highlight_param import HighlightParam
+from karp.search.domain.query_dsl.karp_query_fast_parser import KarpQueryFastParser
 from karp.search.domain.query_dsl.karp_query_model import KarpQueryModelBuilderSemantics, ModelBase
 from karp.search.domain.query_dsl.karp_query_parser import KarpQueryParser
 from karp.search.infrastructure.opensearch import mapping_repo as es_mapping_repo
@@ -21,7 +29,45 @@ from karp.search.infrastructure.opensearch.mapping_repo import Field
 
 logger = logging.getLogger(__name__)
 
-parser = KarpQueryParser(semantics=KarpQueryModelBuilderSemantics())
+# OpenSearch does not allow from + size to be larger than this (index.max_result_window)
+MAX_RESULT_WINDOW = 10000
+# the size of the first page read by scan
+SCAN_FIRST_PAGE_SIZE = 10
+
+if karp_config.QUERY_PARSER == "tatsu":
+    parser = KarpQueryParser(semantics=KarpQueryModelBuilderSemantics())
+else:
+    parser = KarpQueryFastParser()
+
+
+@functools.lru_cache(maxsize=karp_config.QUERY_PARSE_CACHE_SIZE)
+def parse_query(q: str) -> ModelBase:
+    """
+    Parse a query in the Karp query DSL. The same queries are sent over and over, so the results
+    are cached (failed parses are not), see parse_query.cache_info() for hits and misses.
+
+    The returned model is shared and must not be modified.
+    """
+    return parser.parse(q)
+
+
+def compile_query(resources: Iterable[str], q: str, highlight: bool) -> tuple[dict, frozenset[str]]:
+    """
+    Translate a query in the Karp query DSL to the body of an OpenSearch query, and also return
+    the names of the fields in the query (used for highlighting). The results are cached, see
+    _compile_query.cache_info(), and are recomputed when the mappings of the resources change
+    (noticed within MAPPINGS_KEY_TTL seconds, see mapping_repo.get_mappings_key).
+
+    The returned query body is shared and must not be modified.
+    """
+    return _compile_query(tuple(resources), q, highlight, es_mapping_repo.get_mappings_key())
+
+
+@functools.lru_cache(maxsize=karp_config.QUERY_COMPILE_CACHE_SIZE)
+def _compile_query(resources: tuple[str, ...], q: str, highlight: bool, _mappings_key) -> tuple[dict, frozenset[str]]:
+    model = parse_query(q)
+    es_query = EsQueryBuilder(resources, highlight=highlight).walk(model)
+    return es_query.to_dict(), frozenset(EsFieldNameCollector().walk(model))
 
 
 class EsQueryBuilder(NodeWalker):
@@ -248,8 +294,42 @@ def remove_indices_from_path(path: str) -> str:
 
 
 def query(query: QueryRequest):
+    """
+    Search with query. If query.size is None, all hits (after from_) are returned.
+
+    If query.cursor is given, pages are read from a point in time instead, so that the hits do not
+    change between pages and deep pages are as fast as the first one. Use cursor="*" to get the
+    first page and then the cursor in each result to get the next one, with the same q and sort.
+    from_ is ignored. When there are no more hits, the cursor in the result is None.
+    """
     logger.debug("query called", extra={"request": query})
-    return _search_with_query(query)
+    if query.cursor is not None:
+        return _search_with_cursor(query)
+    return _complete_result(query, _search_with_query(query))
+
+
+def scan(query: QueryRequest, page_size: int = 1000) -> Iterator[dict]:
+    """
+    Yield every hit for query, in the same order and format as query() but without the 10000 hit
+    limit. The hits are read in pages from a point in time, using search_after. The pages start
+    small and double in size up to page_size, so that the first hits come quickly. from_ and size
+    are ignored.
+    """
+    size = min(page_size, SCAN_FIRST_PAGE_SIZE)
+    pit_id = _create_pit(query.resources)
+    try:
+        search_after = None
+        while True:
+            page_query = dataclasses.replace(query, from_=0, size=size, lexicon_stats=False)
+            response = _build_search(page_query, query.resources, pit_id, search_after).execute()
+            yield from _format_result(response, path=query.path, highlight=query.highlight)["hits"]
+            if len(response.hits) < size:
+                return
+            pit_id = getattr(response, "pit_id", pit_id)
+            search_after = list(response.hits[-1].meta.sort)
+            size = min(page_size, 2 * size)
+    finally:
+        _delete_pit(pit_id)
 
 
 def query_stats(resources, q):
@@ -275,7 +355,10 @@ def multi_query(queries: list[QueryRequest]):
     for query in queries:
         ms = ms.add(_build_search(query, query.resources))
     responses = ms.execute()
-    return [_build_result(query, response) for query, response in zip(queries, responses, strict=False)]
+    return [
+        _complete_result(query, _build_result(query, response))
+        for query, response in zip(queries, responses, strict=False)
+    ]
 
 
 def _search_with_query(query: QueryRequest):
@@ -285,35 +368,117 @@ def _search_with_query(query: QueryRequest):
     return _build_result(query, response)
 
 
-def _build_search(query, resources: list[str]):
+def _complete_result(query: QueryRequest, result: dict) -> dict:
+    """
+    If query.size is None, the search only returned the first MAX_RESULT_WINDOW hits. Skip from_
+    hits and, if there are more, read all of them with scan.
+    """
+    if query.size is not None:
+        return result
+    if result["total"] <= MAX_RESULT_WINDOW:
+        result["hits"] = result["hits"][query.from_ :]
+    else:
+        result["hits"] = list(itertools.islice(scan(query), query.from_, None))
+    return result
+
+
+def _search_with_cursor(query: QueryRequest):
+    if not query.size:
+        raise KarpError("A size is needed when paging with a cursor")
+    if query.cursor == "*":
+        pit_id, search_after = _create_pit(query.resources), None
+    else:
+        pit_id, search_after = _decode_cursor(query.cursor)
+
+    s = _build_search(dataclasses.replace(query, from_=0), query.resources, pit_id, search_after)
+    try:
+        response = s.execute()
+    except opensearchpy.NotFoundError:
+        # the point in time has expired
+        raise InvalidCursor() from None
+    except opensearchpy.BadRequestError:
+        if query.cursor == "*":
+            raise
+        # the same query worked for the first page, so the pit_id or search_after in the cursor is bad
+        raise InvalidCursor() from None
+    result = _build_result(query, response)
+
+    pit_id = getattr(response, "pit_id", pit_id)
+    if len(response.hits) < query.size:
+        _delete_pit(pit_id)
+        result["cursor"] = None
+    else:
+        result["cursor"] = _encode_cursor(pit_id, list(response.hits[-1].meta.sort))
+    return result
+
+
+def _create_pit(resources: list[str]) -> str:
+    response = os_client.create_pit(index=",".join(resources), keep_alive=karp_config.QUERY_CURSOR_KEEP_ALIVE)
+    return response["pit_id"]
+
+
+def _delete_pit(pit_id: str):
+    try:
+        os_client.delete_pit(body={"pit_id": [pit_id]})
+    except opensearchpy.NotFoundError:
+        pass
+
+
+def _encode_cursor(pit_id: str, search_after: list) -> str:
+    data = json.dumps({"pit_id": pit_id, "search_after": search_after})
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[str, list]:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return data["pit_id"], data["search_after"]
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+        raise InvalidCursor() from None
+
+
+def _build_search(query, resources: list[str], pit_id: str | None = None, search_after: list | None = None):
+    """
+    Build the search for query. If pit_id is given, the search is made in that point in time,
+    after the hit with the sort values search_after.
+    """
     field_names = set()
     es_query = None
-    builder = None
     if query.q:
+        highlight = query.highlight != HighlightParam.false
         try:
             if isinstance(query.q, ModelBase):
                 model = query.q
+                es_query = EsQueryBuilder(resources, highlight=highlight).walk(model).to_dict()
+                field_names = EsFieldNameCollector().walk(model)
             else:
-                model = parser.parse(query.q)
-            builder = EsQueryBuilder(resources, highlight=query.highlight != HighlightParam.false)
-            es_query = builder.walk(model)
-            field_name_collector = EsFieldNameCollector()
-            field_names = field_name_collector.walk(model)
+                es_query, field_names = compile_query(resources, query.q, highlight)
         except tatsu_exc.FailedParse as err:
             raise QueryParserError(failing_query=str(query.q), error_description=str(err)) from err
 
-    s = opensearchpy.Search(using=os_client, index=resources)
+    if pit_id is None:
+        s = opensearchpy.Search(using=os_client, index=resources)
+    else:
+        # the indices are given by the point in time
+        s = opensearchpy.Search(using=os_client)
+        s = s.extra(pit={"id": pit_id, "keep_alive": karp_config.QUERY_CURSOR_KEEP_ALIVE})
+        if search_after is not None:
+            s = s.extra(search_after=search_after)
     s = s.extra(track_total_hits=True)  # get accurate hits numbers
+    if query.source_includes is not None:
+        # the internal fields are always needed, see _format_result
+        internal_fields = [field.name for field in es_mapping_repo.internal_fields.values()]
+        s = s.source(includes=[*query.source_includes, *internal_fields])
     if es_query is not None:
-        s = s.query(es_query)
+        # the query body is copied when the search is serialized, so the cached one is not modified
+        s = s.extra(query=es_query)
 
-    if query.size:
+    if query.size is not None:
         s = s[query.from_ : query.from_ + query.size]
     else:
-        # Elasticsearch defaults to only 10 results if size is unspecified
-        # TODO: how can we return all results? By default it only allows
-        # from + size <= 10000
-        s = s[query.from_ : 10000]
+        # Elasticsearch defaults to only 10 results if size is unspecified, get as many as possible
+        # and the rest with scan, see _complete_result
+        s = s[:MAX_RESULT_WINDOW]
 
     if query.lexicon_stats:
         s.aggs.bucket("distribution", "terms", field="_index", size=len(resources))
@@ -330,13 +495,17 @@ def _build_search(query, resources: list[str]):
     if query.size != 0:
         # if no hits are returned, no sorting is needed
         if query.sort:
-            s = s.sort(*mapping_repo.translate_sort_fields(tuple(resources), tuple(query.sort)))
+            sort = mapping_repo.translate_sort_fields(tuple(resources), tuple(query.sort))
         else:
-            new_s = mapping_repo.get_default_sort(tuple(resources))
-            if new_s:
-                s = s.sort(*new_s)
-
-    logger.debug("s = %s", extra={"es_query s": s.to_dict()})
+            sort = mapping_repo.get_default_sort(tuple(resources)) or []
+        if pit_id is not None:
+            # search_after needs a unique sort order, each index has one shard so this is enough
+            sort = [*sort, "_index", "_doc"]
+        if sort:
+            s = s.sort(*sort)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("s = %s", extra={"es_query s": s.to_dict()})
     return s
 
 
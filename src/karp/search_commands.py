@@ -1,9 +1,23 @@
 import logging
+import multiprocessing
+import queue
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import opensearchpy
 
 import karp.plugins as plugins
-from karp.globals import session
+from karp.foundation.pipeline import StageStats, run_pipeline
+from karp.foundation.timings import utc_now
+from karp.globals import new_session, session
 from karp.lex.application import entry_queries, resource_queries
+from karp.lex.domain.dtos import EntryDto
+from karp.lex.domain.errors import ResourceNotFound
+from karp.lex.infrastructure.sql import index_outbox, reindex_checkpoints, resource_repository, search_generations
+from karp.main.errors import KarpError
 from karp.search.infrastructure.opensearch import indices as es_index
+from karp.search.infrastructure.opensearch import mapping_repo
 from karp.search.infrastructure.transformers import entry_transformer
 
 logger = logging.getLogger(__name__)
@@ -11,77 +25,371 @@ logger = logging.getLogger(__name__)
 
 def set_index(resource_id, index_name):
     es_index.create_alias(resource_id, index_name)
+    search_generations.bump([resource_id])
+    session.commit()
     logger.info(f"Set index {index_name} as the current index for {resource_id}")
 
 
-def reindex_resource(resource_id, remove_old_index):
+def reindex_resource(
+    resource_id, remove_old_index, fetch_size=1000, resume=False, processes=1, stats=None, restart=False
+):
     """
-    Create a new index with the latest versions of all non-discarded entries. Check for changes
-    done during reindex and loop until the new index and db are synced. Optionally remove the old index
-    using remove_old_index and finally update the alias for resource_id to the new index.
+    Create a new index with the latest versions of all non-discarded entries. Optionally remove the old
+    index using remove_old_index and finally update the alias for resource_id to the new index.
+
+    While the reindex is active (that is, while there is a checkpoint), apply_index_outbox writes all
+    edits to the new index as well as to the current one. The entries are indexed with their versions
+    as external versions, so an entry that is read by the reindex and then edited ends up in its
+    latest version, whichever write comes first. Therefore one pass over the entries is enough.
+
+    Entries are streamed from the database, fetch_size at a time, in id order. After every fetch_size
+    entries, a checkpoint is saved. If the reindex is interrupted, it can be continued using resume=True,
+    which adds the remaining entries to the same new index. A new reindex cannot be started while there
+    is a checkpoint, unless restart=True, which first removes the interrupted reindex, see abort_reindex.
+
+    With processes > 1, the id range is split into that many partitions that are expanded and indexed
+    in parallel by worker processes. The checkpoint then covers the finished partitions (in id order)
+    and the progress of the first unfinished one, so a resumed reindex may redo some entries.
+
+    Reading from the database, expanding plugins and bulk indexing run concurrently, see
+    _index_entries. If stats is given, it is filled with a StageStats per stage.
 
-    Returns the total count and a generator, so that progress can be followed.
+    Returns the total count and a generator, so that progress can be followed. When resuming, the
+    generator only yields for the remaining entries.
     """
     logger.info("Reindexing resource '%s'", resource_id)
+    if resume and restart:
+        raise KarpError("A reindex cannot both be resumed and restarted")
     resource = resource_queries.by_resource_id(resource_id, expand_plugins=plugins.INDEXED)
 
-    # create and add data to new index without touching the old alias
-    index_name = es_index.create_index(resource_id, resource.config, call_create_alias=False)
+    if restart:
+        abort_reindex(resource_id)
 
-    def gen():
-        from_timestamp = 0
-        to_timestamp = entry_queries.get_max_last_modified(resource_id)
-        # loop while updates that are not added to the new index are found
-        while True:
-            if from_timestamp != 0:
-                # after the first iteration, there might be deletes of previously indexed entry
-                removed_entries = entry_queries.deleted_entries(resource_id, last_modified=from_timestamp)
-                logger.info("Syncing deletions to new index")
-                errors = es_index.delete_entries(
-                    index_name, entry_ids=(str(entry_id) for entry_id in removed_entries), raise_on_error=False
-                )
-                # an entry could be added AND deleted during reindex
-                for error in errors:
-                    logger.info(f"Something was probably added and deleted during reindex: {error}")
-                logger.info("Syncing new additions/updates to new index")
-
-            entries = entry_queries.all_entries(
-                resource_id, last_modified=from_timestamp, expand_plugins=plugins.INDEXED
+    if resume:
+        checkpoint = get_reindex_checkpoint(resource_id)
+        if checkpoint is None:
+            raise KarpError(f"There is no interrupted reindex of '{resource_id}' to resume")
+        logger.info("Resuming reindex into %s after %d entries", checkpoint.index_name, checkpoint.indexed)
+        index_name = checkpoint.index_name
+        last_entity_id = checkpoint.last_entity_id
+        indexed = checkpoint.indexed
+        started_at = checkpoint.started_at
+    else:
+        if checkpoint := get_reindex_checkpoint(resource_id):
+            # starting over would leave the new index of that reindex behind, without edits written to it
+            raise KarpError(
+                f"A reindex of '{resource_id}' into {checkpoint.index_name} is running or was interrupted,"
+                " use --resume to continue it or --restart to start over"
             )
+        # create and add data to new index without touching the old alias
+        index_name = es_index.create_index(resource_id, resource.config, call_create_alias=False, bulk_load=True)
+        last_entity_id = None
+        indexed = 0
+        started_at = utc_now()
+        # edits are written to the new index from now on
+        _save_reindex_checkpoint(resource_id, index_name, last_entity_id, indexed, started_at)
 
-            yield from es_index.add_entries_gen(index_name, (entry_transformer.transform(entry) for entry in entries))
-
-            # before looking for changes, rollback the session to to start a new transaction
-            session.rollback()
-            new_timestamp = entry_queries.get_max_last_modified(resource_id)
+    def gen():
+        nonlocal last_entity_id, indexed
 
-            if to_timestamp != new_timestamp:
-                logger.info("Something has changed during reindex, try again")
-                from_timestamp = to_timestamp
-                to_timestamp = new_timestamp
-            else:
-                break
+        if processes > 1:
+            last_entity_id, indexed = yield from _index_partitions(
+                resource_id, index_name, last_entity_id, indexed, started_at, fetch_size, processes, stats
+            )
+        else:
+            # the entries are indexed in order, so the last indexed id says how far we have come
+            for entity_id in _index_entries(resource_id, index_name, last_entity_id, None, fetch_size, stats):
+                last_entity_id = entity_id
+                indexed += 1
+                if indexed % fetch_size == 0:
+                    _save_reindex_checkpoint(resource_id, index_name, last_entity_id, indexed, started_at)
+                yield
+        _save_reindex_checkpoint(resource_id, index_name, last_entity_id, indexed, started_at)
 
-        # manually refresh since es_index.add_entries was called with refresh=False
-        es_index.refresh_index(index_name)
+        # refresh, since es_index.add_entries was called with refresh=False, and restore the settings
+        # that were turned off for bulk indexing
+        es_index.finish_bulk_load(index_name, resource.config)
 
         if remove_old_index:
             es_index.delete_index(resource_id)
 
         # now when the data adding is done, point alias to the new index
         es_index.create_alias(resource_id, index_name)
+        with new_session():
+            reindex_checkpoints.remove(resource_id)
+            search_generations.bump([resource_id])
+            session.commit()
         logger.info("Reindexing done")
 
     count = entry_queries.count_all_entries(resource_id)
     return count, gen()
 
 
+def _index_entries(resource_id, index_name, after_id, until_id, fetch_size, stats=None):
+    """
+    Index the entries with after_id < id <= until_id in a pipeline of three threads: one reads the
+    entries from the database, one expands the plugins and transforms the entries for the index,
+    and one writes them in bulk requests. This way the SQL and OpenSearch I/O overlap with the CPU
+    work. Yields the ids of the indexed entries, in order.
+    """
+    resource_config = resource_queries.by_resource_id(resource_id, expand_plugins=False).config
+
+    def read():
+        with new_session():
+            entries = resource_repository.entries_by_resource_id(resource_id)
+            for entry in entries.entries_by_id_range(after_id=after_id, until_id=until_id, fetch_size=fetch_size):
+                yield EntryDto.from_entry(entry)
+
+    def expand(entry_dtos):
+        # plugins may read other resources, so this thread also needs a session
+        with new_session():
+            for entry_dto in plugins.transform_entries(resource_config, entry_dtos, expand_plugins=plugins.INDEXED):
+                yield entry_transformer.transform(entry_dto)
+
+    def write(index_entries):
+        # edits made during the reindex are also written to the index, see reindex_resource
+        return es_index.add_entries_gen(index_name, index_entries, versioned=True)
+
+    return run_pipeline(("read", read), ("expand", expand), ("index", write), stats=stats)
+
+
+def _index_partitions(resource_id, index_name, after_id, indexed, started_at, fetch_size, processes, stats=None):
+    """
+    Index the entries with id > after_id using a pool of worker processes, one partition of the ids
+    at a time per worker. Yields once per indexed entry and returns the last checkpoint, as
+    (last_entity_id, indexed).
+    """
+    after_id = str(after_id) if after_id is not None else None
+    boundaries = [str(entity_id) for entity_id in entry_queries.partition_ids(resource_id, processes, after_id)]
+    partitions = list(zip([after_id, *boundaries], [*boundaries, None], strict=True))
+    logger.info("Indexing %d partitions using %d processes", len(partitions), processes)
+
+    counts = [0] * len(partitions)
+    last_ids = [None] * len(partitions)
+    finished = [False] * len(partitions)
+    checkpoint = (after_id, indexed)
+
+    # spawn fresh processes, each worker creates its own database engine and OpenSearch client
+    context = multiprocessing.get_context("spawn")
+    progress = context.Queue()
+    with ProcessPoolExecutor(
+        max_workers=processes, mp_context=context, initializer=_init_partition_worker, initargs=(progress,)
+    ) as executor:
+        futures = [
+            executor.submit(_index_partition, resource_id, index_name, partition, start, end, fetch_size)
+            for partition, (start, end) in enumerate(partitions)
+        ]
+        while not all(finished):
+            try:
+                partition, count, last_id, done = progress.get(timeout=1)
+            except queue.Empty:
+                for future in futures:
+                    if future.done() and future.exception() is not None:
+                        raise future.exception() from None
+                continue
+            counts[partition] += count
+            last_ids[partition] = last_id or last_ids[partition]
+            finished[partition] = done
+            for _ in range(count):
+                yield
+
+            # everything up to the first unfinished partition, and in it up to its last id, is indexed
+            last_entity_id, total = after_id, indexed
+            for (start, end), count, last_id, done in zip(partitions, counts, last_ids, finished, strict=True):
+                total += count
+                if not done:
+                    last_entity_id = last_id or start
+                    break
+                last_entity_id = end or last_id or start
+            if checkpoint != (last_entity_id, total):
+                checkpoint = (last_entity_id, total)
+                _save_reindex_checkpoint(resource_id, index_name, last_entity_id, total, started_at)
+
+        if stats is not None:
+            # sum up the stages of all workers, the rates are then per worker
+            totals = {}
+            for future in futures:
+                for stage in future.result():
+                    total = totals.setdefault(stage.name, StageStats(stage.name))
+                    total.items += stage.items
+                    total.seconds += stage.seconds
+            stats.extend(totals.values())
+    return checkpoint
+
+
+_progress = None
+
+
+def _init_partition_worker(progress):
+    global _progress
+    _progress = progress
+
+    from karp.main import bootstrap_app
+
+    bootstrap_app()
+
+
+def _index_partition(resource_id, index_name, partition, after_id, until_id, fetch_size):
+    """
+    Runs in a worker process. Index the entries with after_id < id <= until_id and report
+    (partition, count, last id, done) to the parent after every fetch_size entries.
+    Returns the stats of the stages.
+    """
+    stats = []
+    with new_session():
+        count, last_entity_id = 0, None
+        for last_entity_id in _index_entries(resource_id, index_name, after_id, until_id, fetch_size, stats):
+            count += 1
+            if count == fetch_size:
+                _progress.put((partition, count, last_entity_id, False))
+                count = 0
+        _progress.put((partition, count, last_entity_id, True))
+    return stats
+
+
+def abort_reindex(resource_id):
+    """
+    Remove an interrupted reindex of the resource: its checkpoint, so that edits are no longer
+    written to its new index, and then the new index. Returns False if there was no reindex.
+    """
+    checkpoint = reindex_checkpoints.by_resource_id(resource_id)
+    if checkpoint is None:
+        return False
+    logger.info("Removing the reindex of '%s' into %s", resource_id, checkpoint.index_name)
+    reindex_checkpoints.remove(resource_id)
+    session.commit()
+    es_index.delete_index_by_name(checkpoint.index_name)
+    return True
+
+
+def get_reindex_checkpoint(resource_id):
+    """The checkpoint of an interrupted reindex of the resource, or None."""
+    return reindex_checkpoints.by_resource_id(resource_id)
+
+
+def _save_reindex_checkpoint(resource_id, index_name, last_entity_id, indexed, started_at):
+    # use a separate session, the main session is used while streaming entries
+    with new_session():
+        reindex_checkpoints.save(resource_id, index_name, last_entity_id, indexed, started_at)
+        session.commit()
+
+
 def reindex_entry(resource_id: str, entry_id: str):
+    resource = resource_queries.by_resource_id(resource_id, expand_plugins=False)
     entry = entry_queries.by_id(resource_id, entry_id, expand_plugins=plugins.INDEXED)
     tmp = entry_transformer.transform(entry)
-    es_index.add_entries(resource_id, (tmp,))
+    es_index.add_entries(resource_id, (tmp,), versioned=_has_external_versions(resource_id))
+    if checkpoint := reindex_checkpoints.by_resource_id(resource_id):
+        es_index.add_entries(checkpoint.index_name, (tmp,), versioned=True)
+    es_index.refresh_after_write(resource_id, es_index.refresh_policy(resource.config))
+    search_generations.bump([resource_id])
+    session.commit()
+
+
+def apply_index_outbox(batch_size=1000, ids=None) -> int:
+    """
+    Write the latest versions of (at most batch_size) entries in the index outbox to the index,
+    or delete them from the index if they are discarded, and remove them from the outbox.
+    If ids is given, only these outbox rows are handled.
+
+    All changes are sent to OpenSearch in one streaming bulk request (two if some resources use the
+    wait_for refresh policy), with the plugins of each resource expanded for all its entries at once.
+    If a resource is being reindexed, the changes are also written to the new index.
+
+    The entry versions are used as external versions in the index, so if several processes handle
+    the outbox at the same time, an older version is never written over a newer one. Indices created
+    before this was introduced are written to without versions, see mapping_repo.has_external_versions. The search
+    generations of the changed resources are increased, so that cached search results are dropped.
+
+    Returns the number of handled outbox rows, 0 means that there was nothing to do.
+    """
+    rows = index_outbox.pending(batch_size, ids=ids)
+    if not rows:
+        return 0
+
+    entity_ids = defaultdict(set)
+    for row in rows:
+        entity_ids[row.resource_id].add(row.entity_id)
+
+    # the latest versions are read, so it does not matter in which order the changes were made and
+    # all outbox rows for these entries (also those outside of the batch) are handled at once
+    handled_ids = {row.id for row in rows}
+    refresh_policies = {}
+    actions = defaultdict(list)
+    for resource_id, ids_in_resource in entity_ids.items():
+        handled_ids.update(index_outbox.for_entries(resource_id, ids_in_resource))
+        try:
+            resource = resource_queries.by_resource_id(resource_id, expand_plugins=False)
+            entries = entry_queries.by_ids(resource_id, ids_in_resource, expand_plugins=plugins.INDEXED)
+        except ResourceNotFound:
+            logger.info("Resource '%s' is removed, skipping its entries in the index outbox", resource_id)
+            continue
+        refresh_policy = refresh_policies[resource_id] = es_index.refresh_policy(resource.config)
+        reindex_checkpoint = reindex_checkpoints.by_resource_id(resource_id)
+        versioned = _has_external_versions(resource_id)
+        for entry in entries:
+            index_entry = None if entry.discarded else entry_transformer.transform(entry)
+            actions[refresh_policy == "wait_for"].append(_entry_action(resource_id, entry, index_entry, versioned))
+            # the new index is not searchable yet, so there is nothing to wait for
+            if reindex_checkpoint is not None:
+                actions[False].append(_entry_action(reindex_checkpoint.index_name, entry, index_entry, True))
+
+    es_index.bulk(actions[False])
+    if actions[True]:
+        es_index.bulk(actions[True], refresh="wait_for")
+    for resource_id, refresh_policy in refresh_policies.items():
+        es_index.refresh_after_write(resource_id, refresh_policy)
+
+    index_outbox.remove(handled_ids)
+    search_generations.bump(refresh_policies)
+    session.commit()
+    return len(rows)
+
+
+def _entry_action(index_name, entry, index_entry, versioned):
+    if index_entry is None:
+        return es_index.delete_action(index_name, entry.id, version=entry.version if versioned else None)
+    return es_index.index_action(index_name, index_entry, versioned=versioned)
+
+
+def _has_external_versions(resource_id):
+    """See mapping_repo.has_external_versions, warns if the resource must be reindexed."""
+    if mapping_repo.has_external_versions(resource_id):
+        return True
+    logger.warning(
+        "The index of '%s' does not use entry versions, reindex it so that edits handled by several"
+        " processes are written in order",
+        resource_id,
+    )
+    return False
+
+
+def run_index_worker(batch_size=1000, poll_interval=1.0):
+    """
+    Apply the changes in the index outbox as they come, until interrupted. If OpenSearch is not
+    available, the changes are kept in the outbox and tried again later.
+    """
+    logger.info("Index worker started")
+    while True:
+        try:
+            handled = apply_index_outbox(batch_size=batch_size)
+        except (KarpError, opensearchpy.exceptions.TransportError):
+            logger.exception("Failed to apply changes in the index outbox, trying again")
+            session.rollback()
+            handled = 0
+        if handled:
+            logger.info("Indexed %d changes", handled)
+        else:
+            # end the transaction, otherwise new changes might not be seen
+            session.rollback()
+            time.sleep(poll_interval)
 
 
-def reindex_all_resources(remove_old_index):
+def reindex_all_resources(remove_old_index, fetch_size=1000, processes=1, restart=False):
     for resource in resource_queries.get_all_resources():
-        reindex_resource(resource.resource_id, remove_old_index)
+        _, gen = reindex_resource(
+            resource.resource_id, remove_old_index, fetch_size=fetch_size, processes=processes, restart=restart
+        )
+        # nothing is indexed until the generator is exhausted
+        for _ in gen:
+            pass
@@ -61,11 +61,7 @@ def reset_caches():
     caches to make all tests pass in the same run.
     """
     yield
-    for func in dir(mapping_repo):
-        func = getattr(mapping_repo, func)
-        clear_fun = getattr(func, "cache_clear", None)
-        if clear_fun:
-            clear_fun()
+    mapping_repo.clear_caches()
 
 
 def create_and_publish_resource(*, path_to_config: str) -> Tuple[bool, Optional[dict[str, Any]]]:
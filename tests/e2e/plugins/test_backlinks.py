@@ -49,3 +49,19 @@ def test_backlink(fa_backlink_data_client):
     for munic in munics["hits"]:
         entry = munic["entry"]
         assert expects[entry["code"]] == entry["_places"]
+
+
+def test_backlink_with_fields(fa_backlink_data_client):
+    munics = fa_backlink_data_client.get("/query/municipalities?size=100").json()
+    expected = {munic["entry"]["code"]: munic["entry"]["_places"] for munic in munics["hits"]}
+
+    # the plugin needs the code, which is fetched even though it is not returned
+    munics = fa_backlink_data_client.get("/query/municipalities?size=100&fields=id,entry._places").json()
+    for munic in munics["hits"]:
+        assert set(munic) == {"id", "entry"}
+        assert set(munic["entry"]) == {"_places"}
+    assert sorted(munic["entry"]["_places"] for munic in munics["hits"]) == sorted(expected.values())
+
+    # fields that are not returned are not expanded
+    munics = fa_backlink_data_client.get("/query/municipalities?size=100&path=entry.code").json()
+    assert sorted(munics["hits"]) == sorted(expected)
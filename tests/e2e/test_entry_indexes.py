@@ -0,0 +1,113 @@
+"""Check that the queries in EntryRepository use the indexes of the entry tables."""
+
+import re
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from karp.globals import new_session, session
+from karp.lex.infrastructure.sql import resource_repository
+
+
+@contextmanager
+def capture_statements():
+    """Collect all SQL statements (with parameters) executed in the block."""
+    engine = session.get_bind()
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def query_plan(statement, parameters) -> list[dict]:
+    """
+    Returns the query plan as a list of {"table", "indexes", "detail"}, where indexes are the indexes
+    that the database used (SQLite) or used and considered (MariaDB) for the table. On MariaDB the
+    small test tables would often be scanned anyway, so we can only check that the index is usable.
+    """
+    engine = session.get_bind()
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            plan = []
+            for row in rows:
+                detail = row[-1]
+                match = re.match(r"(?:SCAN|SEARCH) (\S+)(?: USING (?:COVERING )?INDEX (\S+))?", detail)
+                if match:
+                    table, index = match.groups()
+                    plan.append({"table": table, "indexes": {index} if index else set(), "detail": detail})
+                else:
+                    plan.append({"table": None, "indexes": set(), "detail": detail})
+            return plan
+
+        rows = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters).mappings().all()
+        return [
+            {
+                "table": row["table"],
+                "indexes": (set((row["possible_keys"] or "").split(",")) | {row["key"]}) - {"", None},
+                "detail": row["Extra"] or "",
+            }
+            for row in rows
+        ]
+
+
+@pytest.fixture(name="places")
+def fixture_places(fa_data_client):
+    with new_session():
+        yield resource_repository.entries_by_resource_id("places")
+
+
+def test_latest_entries_are_not_grouped(places):
+    with capture_statements() as statements:
+        list(places.all_entries())
+
+    for statement, parameters in statements:
+        for step in query_plan(statement, parameters):
+            assert "TEMP B-TREE FOR GROUP BY" not in step["detail"]
+            assert "Using temporary" not in step["detail"]
+
+
+def test_latest_entries_since_uses_index(places):
+    table_name = places.history_model.__tablename__
+    with capture_statements() as statements:
+        list(places.all_entries(last_modified=1))
+
+    plan = [step for statement, parameters in statements for step in query_plan(statement, parameters)]
+    history_steps = [step for step in plan if step["table"] == table_name]
+    assert history_steps
+    for step in history_steps:
+        assert step["indexes"] & {f"{table_name}_dlm", f"{table_name}_lm"}, step
+
+
+def test_max_last_modified_uses_index(places):
+    table_name = places.history_model.__tablename__
+    with capture_statements() as statements:
+        places.get_max_last_modified()
+
+    (statement, parameters) = statements[-1]
+    plan = query_plan(statement, parameters)
+    assert any(f"{table_name}_lm" in step["indexes"] or "optimized away" in step["detail"] for step in plan), plan
+
+
+@pytest.mark.parametrize(
+    "kwargs,index_suffix",
+    [
+        ({}, "_lm"),
+        ({"user_id": "user1"}, "_lmb"),
+    ],
+)
+def test_history_uses_index(places, kwargs, index_suffix):
+    table_name = places.history_model.__tablename__
+    with capture_statements() as statements:
+        places.get_history(include_total=False, **kwargs)
+
+    (statement, parameters) = statements[-1]
+    plan = query_plan(statement, parameters)
+    assert any(table_name + index_suffix in step["indexes"] for step in plan), plan
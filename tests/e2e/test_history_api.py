@@ -153,6 +153,41 @@ class TestGetHistory:
         for history_entry in history.history:
             assert history_entry.user_id == "user2"
 
+    def test_cursor_paging(  # noqa: ANN201
+        self,
+        fa_data_client,
+        admin_token: AccessToken,
+        history_entity_ids: list[str],
+    ):
+        response_data = get_helper(fa_data_client, "/history/places?user_id=user2", admin_token)
+        all_history = GetHistoryDto(**response_data)
+        assert all_history.next_cursor is None
+
+        first_page = GetHistoryDto(
+            **get_helper(fa_data_client, "/history/places?user_id=user2&page_size=3", admin_token)
+        )
+        assert first_page.total == 4
+        assert first_page.next_cursor is not None
+        second_page = GetHistoryDto(
+            **get_helper(
+                fa_data_client,
+                f"/history/places?user_id=user2&page_size=3&include_total=false&cursor={first_page.next_cursor}",
+                admin_token,
+            )
+        )
+        assert second_page.total is None
+        assert second_page.next_cursor is None
+        assert first_page.history + second_page.history == all_history.history
+
+    def test_invalid_cursor(  # noqa: ANN201
+        self,
+        fa_data_client,
+        admin_token: AccessToken,
+        history_entity_ids: list[str],
+    ):
+        response = fa_data_client.get("/history/places?cursor=apa", headers=admin_token.as_header())
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
     def test_user_history_from_date(  # noqa: ANN201
         self,
         fa_data_client,
@@ -232,6 +267,22 @@ class TestGetHistory:
             print(f"diff = {diff}")
             assert diff["type"] == "ADDED"
 
+    def test_diff_against_previous_version(  # noqa: ANN201
+        self,
+        fa_data_client,
+        admin_token: AccessToken,
+        history_entity_ids: list[str],
+    ):
+        response_data = get_helper(
+            fa_data_client,
+            f"/history/places?entry_id={history_entity_ids[1]}",
+            admin_token,
+        )
+        history = GetHistoryDto(**response_data)
+        assert [history_entry.version for history_entry in history.history] == [2, 1]
+        assert history.history[0].diff == [{"type": "CHANGE", "field": "name", "before": "b", "after": "bb"}]
+        assert all(diff["type"] == "ADDED" for diff in history.history[1].diff)
+
 
 def test_historical_entry(  # noqa: ANN201
     fa_data_client,
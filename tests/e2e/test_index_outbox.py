@@ -0,0 +1,134 @@
+import karp.plugins as plugins
+from karp import search_commands
+from karp.entry_commands import EntryCommands
+from karp.foundation.value_objects import make_unique_id
+from karp.globals import new_session, os_client
+from karp.lex.application import entry_queries
+from karp.lex.infrastructure.sql import index_outbox
+from karp.search.infrastructure.opensearch import mapping_repo
+from tests.utils import get_json
+
+
+def pending_ids():
+    with new_session():
+        return {row.entity_id for row in index_outbox.pending(1000)}
+
+
+def search(client, token, name):
+    return get_json(client, f"/query/places?q=equals|name|{name}", headers=token.as_header())["hits"]
+
+
+def test_changes_are_indexed_from_outbox(fa_data_client, admin_token):
+    entry_id = make_unique_id()
+    with new_session():
+        EntryCommands(wait_for_index=False).add_entry(
+            "places", entry_id, {"code": 1300, "name": "outbox", "municipality": [1]}, user="test", message="add"
+        )
+    assert entry_id in pending_ids()
+    assert search(fa_data_client, admin_token, "outbox") == []
+
+    with new_session():
+        while search_commands.apply_index_outbox():
+            pass
+    assert entry_id not in pending_ids()
+    assert len(search(fa_data_client, admin_token, "outbox")) == 1
+
+    with new_session():
+        EntryCommands(wait_for_index=False).delete_entry("places", entry_id, user="test", version=1)
+        search_commands.apply_index_outbox()
+    assert search(fa_data_client, admin_token, "outbox") == []
+
+
+def test_waiting_for_index_leaves_outbox_empty(fa_data_client, admin_token):
+    entry_id = make_unique_id()
+    with new_session():
+        EntryCommands().add_entry(
+            "places", entry_id, {"code": 1301, "name": "no_outbox", "municipality": [1]}, user="test", message="add"
+        )
+    assert entry_id not in pending_ids()
+    assert len(search(fa_data_client, admin_token, "no_outbox")) == 1
+
+
+def test_repeated_edits_are_indexed_once(fa_data_client, admin_token):
+    entry_id = make_unique_id()
+    with new_session():
+        entry_commands = EntryCommands(wait_for_index=False)
+        entry_commands.add_entry(
+            "places", entry_id, {"code": 1302, "name": "coalesce1", "municipality": [1]}, user="test", message="add"
+        )
+        entry_commands.update_entry(
+            "places",
+            entry_id,
+            version=1,
+            user="test",
+            message="update",
+            entry={"code": 1302, "name": "coalesce2", "municipality": [1]},
+        )
+        outbox_ids = index_outbox.for_entries("places", [entry_id])
+        assert len(outbox_ids) == 2
+        # handling one of the rows handles both
+        assert search_commands.apply_index_outbox(batch_size=1, ids=outbox_ids[:1]) == 1
+    assert entry_id not in pending_ids()
+    assert search(fa_data_client, admin_token, "coalesce1") == []
+    assert len(search(fa_data_client, admin_token, "coalesce2")) == 1
+
+
+def test_older_version_does_not_overwrite_newer(fa_data_client, admin_token, monkeypatch):
+    entry_id = make_unique_id()
+    with new_session():
+        entry_commands = EntryCommands(wait_for_index=False)
+        entry_commands.add_entry(
+            "places", entry_id, {"code": 1303, "name": "outoforder1", "municipality": [1]}, user="test", message="add"
+        )
+        # what a slow consumer of the outbox read before the entry was updated
+        old_entries = entry_queries.by_ids("places", [entry_id], expand_plugins=plugins.INDEXED)
+        entry_commands.update_entry(
+            "places",
+            entry_id,
+            version=1,
+            user="test",
+            message="update",
+            entry={"code": 1303, "name": "outoforder2", "municipality": [1]},
+        )
+        with monkeypatch.context() as m:
+            # another consumer indexes the new version first, the rows are left for the slow consumer
+            m.setattr(index_outbox, "remove", lambda ids: None)
+            search_commands.apply_index_outbox()
+        monkeypatch.setattr(entry_queries, "by_ids", lambda *args, **kwargs: old_entries)
+        search_commands.apply_index_outbox()
+    assert entry_id not in pending_ids()
+    assert search(fa_data_client, admin_token, "outoforder1") == []
+    assert len(search(fa_data_client, admin_token, "outoforder2")) == 1
+
+
+def test_index_without_external_versions_is_updated(fa_data_client, admin_token):
+    entry_id = make_unique_id()
+    with new_session():
+        entry_commands = EntryCommands(wait_for_index=False)
+        entry_commands.add_entry(
+            "places", entry_id, {"code": 1304, "name": "unversioned1", "municipality": [1]}, user="test", message="add"
+        )
+        search_commands.apply_index_outbox()
+    # an index made before entry versions were used has internal versions, here higher than the entry version
+    document = os_client.get(index="places", id=str(entry_id))["_source"]
+    for _ in range(3):
+        os_client.index(index="places", id=str(entry_id), body=document)
+    os_client.indices.put_mapping(index="places", body={"_meta": {"external_versions": False}})
+    mapping_repo.clear_caches()
+    try:
+        assert not mapping_repo.has_external_versions("places")
+        with new_session():
+            entry_commands.update_entry(
+                "places",
+                entry_id,
+                version=1,
+                user="test",
+                message="update",
+                entry={"code": 1304, "name": "unversioned2", "municipality": [1]},
+            )
+            search_commands.apply_index_outbox()
+        assert search(fa_data_client, admin_token, "unversioned1") == []
+        assert len(search(fa_data_client, admin_token, "unversioned2")) == 1
+    finally:
+        os_client.indices.put_mapping(index="places", body={"_meta": {"external_versions": True}})
+        mapping_repo.clear_caches()
@@ -0,0 +1,63 @@
+"""Check that the table with the latest version of each entry agrees with the history."""
+
+import importlib
+
+import sqlalchemy as sa
+from sqlalchemy import sql
+
+from karp.entry_commands import EntryCommands
+from karp.foundation.value_objects import make_unique_id
+from karp.globals import new_session, session
+from karp.lex.infrastructure.sql import resource_repository
+
+migration = importlib.import_module("karp.main.migrations.versions.993551c86272_add_latest_version_tables")
+
+
+def latest_versions(entries) -> dict:
+    stmt = sql.select(entries.latest_model.entity_id, entries.latest_model.version)
+    return dict(session.execute(stmt).tuples())
+
+
+def max_versions(entries) -> dict:
+    history = entries.history_model
+    stmt = sql.select(history.entity_id, sa.func.max(history.version)).group_by(history.entity_id)
+    return dict(session.execute(stmt).tuples())
+
+
+def test_latest_version_follows_edits(fa_data_client):
+    entry_id = make_unique_id()
+    with new_session():
+        entries = resource_repository.entries_by_resource_id("places")
+        entry_commands = EntryCommands()
+        entry_commands.add_entry(
+            "places", entry_id, {"code": 1500, "name": "latest", "municipality": [1]}, user="test", message="add"
+        )
+        assert latest_versions(entries)[entry_id] == 1
+
+        entry_commands.update_entry(
+            "places",
+            entry_id,
+            version=1,
+            user="test",
+            message="update",
+            entry={"code": 1500, "name": "latest2", "municipality": [1]},
+        )
+        assert latest_versions(entries)[entry_id] == 2
+
+        entry_commands.delete_entry("places", entry_id, user="test", version=2)
+        assert latest_versions(entries)[entry_id] == 3
+        assert latest_versions(entries) == max_versions(entries)
+
+
+def test_migration_fills_latest_version_table(fa_data_client):
+    with new_session():
+        entries = resource_repository.entries_by_resource_id("places")
+        expected = latest_versions(entries)
+        assert expected
+
+        session.execute(sql.delete(entries.latest_model))
+        assert latest_versions(entries) == {}
+        session.execute(migration.backfill(entries.history_model.__tablename__, entries.latest_model.__tablename__))
+        assert latest_versions(entries) == expected
+        # leave the table as it was
+        session.rollback()
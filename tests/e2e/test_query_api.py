@@ -1,10 +1,18 @@
+import base64
+import json
 from typing import Dict, List, Optional
 
 import pytest
 from fastapi import status
 
+from karp.entry_commands import EntryCommands
+from karp.foundation.value_objects import make_unique_id
 from karp.globals import new_session
-from karp.lex.application import entry_queries
+from karp.lex.application import entry_queries, search_queries
+from karp.lex.application.search_queries import result_cache
+from karp.search.domain import QueryRequest
+from karp.search.infrastructure.opensearch import search_service
+from karp.search.infrastructure.opensearch.search_service import _compile_query
 from tests.e2e.conftest import AccessToken
 from tests.utils import get_json
 
@@ -66,6 +74,48 @@ def test_query_without_highlight(fa_data_client):
             assert "highlight" not in entry
 
 
+def test_compiled_query_is_cached(fa_data_client):
+    _compile_query.cache_clear()
+    url = "/query/places?q=freetext|Norsjö"
+    first = get_json(fa_data_client, url)
+    # otherwise the response is cached, and the query is not compiled again
+    result_cache.clear()
+    assert get_json(fa_data_client, url) == first
+    info = _compile_query.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
+
+    # highlight changes the query body, so it is compiled separately
+    entries = get_json(fa_data_client, url + "&highlight=true")
+    assert all("highlight" in entry for entry in entries["hits"])
+    assert _compile_query.cache_info().misses == 2
+
+
+def test_query_result_is_cached_until_resource_changes(fa_data_client, admin_token):
+    result_cache.clear()
+    url = "/query/places?q=equals|name|cached"
+    assert get_json(fa_data_client, url, headers=admin_token.as_header())["hits"] == []
+    assert get_json(fa_data_client, url, headers=admin_token.as_header())["hits"] == []
+    assert (result_cache.hits, result_cache.misses) == (1, 1)
+
+    entry_id = make_unique_id()
+    with new_session():
+        EntryCommands().add_entry(
+            "places", entry_id, {"code": 1310, "name": "cached", "municipality": [1]}, user="test", message="add"
+        )
+    assert len(get_json(fa_data_client, url, headers=admin_token.as_header())["hits"]) == 1
+
+    with new_session():
+        EntryCommands().delete_entry("places", entry_id, user="test", version=1)
+    assert get_json(fa_data_client, url, headers=admin_token.as_header())["hits"] == []
+
+
+def test_query_without_q_is_cached(fa_data_client):
+    result_cache.clear()
+    first = get_json(fa_data_client, "/query/places")
+    assert get_json(fa_data_client, "/query/places?q=") == first
+    assert (result_cache.hits, result_cache.misses) == (1, 1)
+
+
 def test_query_no_q_with_highlight(fa_data_client):
     entries = get_json(fa_data_client, "/query/places?highlight=true")
     assert len(entries["hits"]) > 0
@@ -189,6 +239,95 @@ def test_path_parameter(fa_data_client):
     assert [2, 3] in response_data["hits"]
 
 
+def test_cursor_pages_through_all_hits(fa_data_client):
+    expected = [entry["id"] for entry in get_json(fa_data_client, "/query/places?size=1000")["hits"]]
+
+    ids = []
+    cursor = "*"
+    while cursor is not None:
+        page = get_json(fa_data_client, f"/query/places?size=5&cursor={cursor}")
+        assert page["total"] == len(expected)
+        assert len(page["hits"]) <= 5
+        ids.extend(entry["id"] for entry in page["hits"])
+        cursor = page["cursor"]
+    # hits with equal sort values may come in a different order
+    assert sorted(ids) == sorted(expected)
+
+
+def test_invalid_cursor(fa_data_client):
+    response = fa_data_client.get("/query/places?cursor=nonsense")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    # decodes, but does not point to a point in time
+    cursor = base64.urlsafe_b64encode(json.dumps({"pit_id": "bad", "search_after": ["x"]}).encode()).decode()
+    response = fa_data_client.get(f"/query/places?size=5&cursor={cursor}")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_scan_and_unbounded_query_return_all_hits(fa_data_client):
+    def ids(hits):
+        return sorted(hit["id"] for hit in hits)
+
+    with new_session():
+        expected = search_queries.query(QueryRequest(resources=["places"], size=1000))["hits"]
+        assert ids(search_queries.scan(QueryRequest(resources=["places"]), batch_size=4)) == ids(expected)
+        assert ids(search_queries.query(QueryRequest(resources=["places"], size=None))["hits"]) == ids(expected)
+        assert len(search_queries.query(QueryRequest(resources=["places"], from_=20, size=None))["hits"]) == (
+            len(expected) - 20
+        )
+
+
+def test_scan_pages_grow(fa_data_client, monkeypatch):
+    sizes = []
+    build_search = search_service._build_search
+
+    def recording_build_search(query, *args, **kwargs):
+        sizes.append(query.size)
+        return build_search(query, *args, **kwargs)
+
+    monkeypatch.setattr(search_service, "_build_search", recording_build_search)
+    monkeypatch.setattr(search_service, "SCAN_FIRST_PAGE_SIZE", 2)
+    with new_session():
+        hits = list(search_queries.scan(QueryRequest(resources=["places"]), batch_size=5))
+    assert len(hits) > 6
+    assert sizes[:3] == [2, 4, 5]
+    assert set(sizes[2:]) == {5}
+
+
+def test_ndjson_format(fa_data_client):
+    expected = get_json(fa_data_client, "/query/places?q=freetext|Piteå&size=1000")["hits"]
+
+    response = fa_data_client.get("/query/places?q=freetext|Piteå&size=1000&format=ndjson")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    hits = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(hit["id"] for hit in hits) == sorted(hit["id"] for hit in expected)
+
+    response = fa_data_client.get("/query/places?q=freetext|Piteå&from=2&size=3&format=ndjson")
+    assert len(response.text.splitlines()) == 3
+
+
+def test_ndjson_format_with_invalid_query(fa_data_client):
+    response = fa_data_client.get("/query/places?q=equals|name&format=ndjson")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_fields_parameter(fa_data_client):
+    full = get_json(fa_data_client, "/query/places?size=100")["hits"]
+
+    hits = get_json(fa_data_client, "/query/places?size=100&fields=id,entry.name,entry._municipality.code")["hits"]
+    assert [hit["id"] for hit in hits] == [hit["id"] for hit in full]
+    for hit, full_hit in zip(hits, full, strict=True):
+        assert set(hit) == {"id", "entry"}
+        assert hit["entry"] == {
+            "name": full_hit["entry"]["name"],
+            "_municipality": [{"code": munic["code"]} for munic in full_hit["entry"]["_municipality"]],
+        }
+
+    names = get_json(fa_data_client, "/query/places?size=100&path=entry.name")["hits"]
+    assert names == [hit["entry"]["name"] for hit in full]
+
+
 # Length queries are unimplemented right now
 @pytest.mark.xfail
 def test_length(fa_data_client):
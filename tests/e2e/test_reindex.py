@@ -0,0 +1,187 @@
+import itertools
+
+import pytest
+
+from karp import search_commands
+from karp.entry_commands import EntryCommands
+from karp.foundation.value_objects import make_unique_id
+from karp.globals import new_session, os_client
+from karp.lex.application import entry_queries
+from karp.main import config as karp_config
+from karp.main.errors import KarpError
+from karp.search.infrastructure.opensearch import mapping_repo
+
+
+def index_count(resource_id):
+    return os_client.count(index=resource_id)["count"]
+
+
+def test_reindex(fa_data_client):
+    with new_session():
+        count, gen = search_commands.reindex_resource("places", remove_old_index=True, fetch_size=2)
+        assert len(list(gen)) == count
+        assert search_commands.get_reindex_checkpoint("places") is None
+    assert index_count("places") == count
+
+
+def test_edits_during_reindex_are_in_new_index(fa_data_client):
+    added_id = make_unique_id()
+    with new_session():
+        entries = list(entry_queries.all_entries("places"))
+        updated, deleted = entries[0], entries[-1]
+
+        count, gen = search_commands.reindex_resource("places", remove_old_index=True, fetch_size=2)
+        # start the reindex, the rest of the entries are read after the edits
+        next(gen)
+
+        entry_commands = EntryCommands()
+        entry_commands.add_entry(
+            "places",
+            added_id,
+            {"code": 1400, "name": "during_reindex", "municipality": [1]},
+            user="test",
+            message="add",
+        )
+        entry_commands.update_entry(
+            "places",
+            updated.id,
+            version=updated.version,
+            user="test",
+            message="update",
+            entry={**updated.entry, "name": "updated_during_reindex"},
+        )
+        entry_commands.delete_entry("places", deleted.id, user="test", version=deleted.version)
+        list(gen)
+
+    assert index_count("places") == count
+    assert os_client.get(index="places", id=str(added_id))["_source"]["name"] == "during_reindex"
+    assert os_client.get(index="places", id=str(updated.id))["_source"]["name"] == "updated_during_reindex"
+    assert not os_client.exists(index="places", id=str(deleted.id))
+
+
+def test_reindex_restores_index_settings(fa_data_client):
+    with new_session():
+        _, gen = search_commands.reindex_resource("places", remove_old_index=True)
+        list(gen)
+    index_settings = os_client.indices.get_settings(index="places")
+    ((_, index),) = index_settings.items()
+    assert index["settings"]["index"]["number_of_replicas"] == "1"
+    assert "flush_threshold_size" not in index["settings"]["index"].get("translog", {})
+    assert "gc_deletes" not in index["settings"]["index"]
+
+
+def test_reindex_without_force_merge(fa_data_client, monkeypatch):
+    monkeypatch.setattr(karp_config, "INDEX_FORCE_MERGE", False)
+    with new_session():
+        count, gen = search_commands.reindex_resource("places", remove_old_index=True)
+        assert len(list(gen)) == count
+    assert index_count("places") == count
+
+
+def test_parallel_reindex(fa_data_client):
+    with new_session():
+        count, gen = search_commands.reindex_resource("places", remove_old_index=True, fetch_size=2, processes=3)
+        assert len(list(gen)) == count
+        assert search_commands.get_reindex_checkpoint("places") is None
+    assert index_count("places") == count
+
+
+def test_reindex_with_parallel_bulk_requests(fa_data_client, monkeypatch):
+    monkeypatch.setattr(karp_config, "INDEX_BULK_THREADS", 3)
+    monkeypatch.setattr(karp_config, "INDEX_BULK_CHUNK_SIZE", 2)
+    with new_session():
+        count, gen = search_commands.reindex_resource("places", remove_old_index=True, fetch_size=2)
+        assert len(list(gen)) == count
+    assert index_count("places") == count
+
+
+def test_partitions_cover_all_entries(fa_data_client):
+    with new_session():
+        boundaries = entry_queries.partition_ids("places", 3)
+        assert len(boundaries) == 2
+        partitions = zip([None, *boundaries], [*boundaries, None], strict=True)
+        ids = [
+            entry.id
+            for after_id, until_id in partitions
+            for entry in entry_queries.entries_by_id_range("places", after_id=after_id, until_id=until_id)
+        ]
+        assert ids == sorted(entry.id for entry in entry_queries.all_entries("places"))
+
+
+def test_resume_interrupted_reindex(fa_data_client):
+    with new_session():
+        count, gen = search_commands.reindex_resource("places", remove_old_index=True, fetch_size=2)
+        # interrupt after a few entries
+        list(itertools.islice(gen, 5))
+        gen.close()
+
+        checkpoint = search_commands.get_reindex_checkpoint("places")
+        assert checkpoint.indexed == 4
+        index_name = checkpoint.index_name
+
+        _, gen = search_commands.reindex_resource("places", remove_old_index=True, fetch_size=2, resume=True)
+        assert len(list(gen)) == count - 4
+        assert search_commands.get_reindex_checkpoint("places") is None
+        assert entry_queries.count_all_entries("places") == count
+    assert index_count("places") == count
+    assert list(os_client.indices.get_alias(name="places")) == [index_name]
+
+
+def test_reindex_without_resume_fails_when_interrupted(fa_data_client):
+    with new_session():
+        _, gen = search_commands.reindex_resource("places", remove_old_index=True, fetch_size=2)
+        list(itertools.islice(gen, 3))
+        gen.close()
+        index_name = search_commands.get_reindex_checkpoint("places").index_name
+
+        with pytest.raises(KarpError):
+            search_commands.reindex_resource("places", remove_old_index=True)
+        assert search_commands.get_reindex_checkpoint("places").index_name == index_name
+
+        _, gen = search_commands.reindex_resource("places", remove_old_index=True, resume=True)
+        list(gen)
+        assert search_commands.get_reindex_checkpoint("places") is None
+
+
+def test_restart_removes_interrupted_reindex(fa_data_client):
+    with new_session():
+        _, gen = search_commands.reindex_resource("places", remove_old_index=True, fetch_size=2)
+        list(itertools.islice(gen, 3))
+        gen.close()
+        index_name = search_commands.get_reindex_checkpoint("places").index_name
+
+        count, gen = search_commands.reindex_resource("places", remove_old_index=True, restart=True)
+        assert not os_client.indices.exists(index=index_name)
+        assert len(list(gen)) == count
+        assert search_commands.get_reindex_checkpoint("places") is None
+    assert index_count("places") == count
+
+
+def test_abort_reindex(fa_data_client):
+    with new_session():
+        _, gen = search_commands.reindex_resource("places", remove_old_index=True, fetch_size=2)
+        list(itertools.islice(gen, 3))
+        gen.close()
+        index_name = search_commands.get_reindex_checkpoint("places").index_name
+
+        assert search_commands.abort_reindex("places")
+        assert search_commands.get_reindex_checkpoint("places") is None
+        assert not os_client.indices.exists(index=index_name)
+        assert not search_commands.abort_reindex("places")
+
+
+def test_resume_without_checkpoint_fails(fa_data_client):
+    with new_session():
+        with pytest.raises(KarpError):
+            search_commands.reindex_resource("places", remove_old_index=True, resume=True)
+
+
+def test_reindex_changes_mappings_key(fa_data_client, monkeypatch):
+    monkeypatch.setattr(mapping_repo, "MAPPINGS_KEY_TTL", 0)
+    before = mapping_repo.get_mappings_key()
+    with new_session():
+        _, gen = search_commands.reindex_resource("places", remove_old_index=True)
+        list(gen)
+    after = mapping_repo.get_mappings_key()
+    assert after != before
+    assert dict(after)["places"] == os_client.indices.get_alias(name="places").popitem()[0]
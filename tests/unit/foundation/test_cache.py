@@ -0,0 +1,30 @@
+from karp.foundation.cache import LRUCache
+
+
+def test_least_recently_used_is_dropped():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_expired_values_are_not_returned(monkeypatch):
+    now = 100.0
+    monkeypatch.setattr("karp.foundation.cache.time.monotonic", lambda: now)
+    cache = LRUCache(10, ttl=5)
+    cache.put("a", 1)
+    now += 5
+    assert cache.get("a") == 1
+    now += 1
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_size_zero_turns_cache_off():
+    cache = LRUCache(0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
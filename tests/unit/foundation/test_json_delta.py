@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from karp.foundation.json import apply_delta, make_delta
+
+
+@pytest.mark.parametrize(
+    "source,target",
+    [
+        ({}, {}),
+        ({"a": 1}, {"a": 2}),
+        ({"a": 1, "b": 2}, {"b": 2}),
+        ({"a": 1}, {"a": 1, "b": {"c": [1, 2]}}),
+        ({"a": [1, 2, 3]}, {"a": [1, 4]}),
+        ({"a": [{"b": 1}]}, {"a": [{"b": 2}, {"c": 3}]}),
+        ({"a": 1}, {"a": True}),
+        ({"a": {"b": 1}}, {"a": [1]}),
+        ({"a": None}, {"a": ""}),
+    ],
+)
+def test_apply_delta(source, target):
+    # the delta is stored as JSON
+    delta = json.loads(json.dumps(make_delta(source, target)))
+    result = apply_delta(delta, source)
+    assert result == target
+    assert json.dumps(result, sort_keys=True) == json.dumps(target, sort_keys=True)
+
+
+def test_apply_delta_does_not_modify_input():
+    source = {"a": [1, 2], "b": {"c": 1}}
+    apply_delta(make_delta(source, {"a": [1], "b": {}}), source)
+    assert source == {"a": [1, 2], "b": {"c": 1}}
+
+
+def test_unchanged_gives_empty_delta():
+    assert make_delta({"a": [1, {"b": 2}]}, {"a": [1, {"b": 2}]}) == []
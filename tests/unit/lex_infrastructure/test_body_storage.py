@@ -0,0 +1,20 @@
+from types import SimpleNamespace
+
+import pytest
+
+from karp.lex.infrastructure.sql import models
+
+BODY = {"baseform": "väg", "inflection": ["vägen", "vägar"], "nested": {"number": 1, "empty": None}}
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_body_roundtrip(compress):
+    values = models.body_values(BODY, compress=compress)
+    assert (values["body"] is None) == compress
+    assert (values["body_compressed"] is None) != compress
+    assert models.row_body(SimpleNamespace(**values)) == BODY
+
+
+def test_compressed_body_is_smaller():
+    body = {"text": "lorem ipsum " * 100}
+    assert len(models.compress_body(body)) < len(models.body_values(body)["body"]["text"])
@@ -0,0 +1,36 @@
+import itertools
+
+import pytest
+
+from karp.foundation.pipeline import run_pipeline
+
+
+def test_stages_are_applied_in_order():
+    stats = []
+    result = run_pipeline(
+        ("read", lambda: range(1000)),
+        ("square", lambda items: (item * item for item in items)),
+        ("format", lambda items: map(str, items)),
+        chunk_size=7,
+        stats=stats,
+    )
+    assert list(result) == [str(i * i) for i in range(1000)]
+    assert [(stage.name, stage.items) for stage in stats] == [("read", 1000), ("square", 1000), ("format", 1000)]
+
+
+def test_error_in_stage_is_raised():
+    def fail(items):
+        for item in items:
+            if item == 50:
+                raise ValueError("boom")
+            yield item
+
+    with pytest.raises(ValueError):
+        list(run_pipeline(("read", lambda: range(100)), ("fail", fail), ("pass", lambda items: items)))
+
+
+def test_close_stops_threads():
+    result = run_pipeline(("read", itertools.count), ("pass", lambda items: items), queue_size=1)
+    assert list(itertools.islice(result, 5)) == [0, 1, 2, 3, 4]
+    # returns instead of waiting for an infinite source
+    result.close()
@@ -0,0 +1,53 @@
+import contextlib
+import threading
+import time
+
+import anyio
+import pytest
+from starlette.requests import ClientDisconnect
+
+from karp.api.routes import query_api
+from karp.search.domain import QueryRequest
+
+
+@pytest.fixture
+def closed(monkeypatch):
+    result = threading.Event()
+
+    def stream(query_request):
+        try:
+            for i in range(100000):
+                time.sleep(0.001)
+                yield {"id": i}
+        finally:
+            result.set()
+
+    monkeypatch.setattr(query_api.search_queries, "stream", stream)
+    monkeypatch.setattr(query_api, "new_session", contextlib.nullcontext)
+    return result
+
+
+@pytest.mark.parametrize("spec_version", ["2.0", "2.4"])
+def test_disconnect_stops_the_search(closed, spec_version):
+    response = query_api._ndjson_response(QueryRequest(resources=["places"]))
+    disconnected = anyio.Event()
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+        if len(sent) > 5:
+            disconnected.set()
+            if spec_version == "2.4":
+                # how newer servers report that the client is gone
+                raise OSError("client disconnected")
+
+    async def receive():
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def run():
+        with contextlib.suppress(ClientDisconnect):
+            await response({"type": "http", "asgi": {"spec_version": spec_version}}, receive, send)
+
+    anyio.run(run)
+    assert closed.is_set()
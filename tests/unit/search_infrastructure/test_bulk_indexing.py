@@ -0,0 +1,84 @@
+import json
+from types import SimpleNamespace
+
+import opensearchpy.helpers.actions
+import pytest
+from opensearchpy.exceptions import TransportError
+from opensearchpy.serializer import JSONSerializer
+
+from karp.globals import os_client
+from karp.main import config as karp_config
+from karp.search.domain.index_entry import IndexEntry
+from karp.search.infrastructure.opensearch import indices
+
+
+class FakeOpenSearch:
+    """Answers bulk requests, rejecting the first ones with 429 Too Many Requests."""
+
+    def __init__(self, rejections=0):
+        self.transport = SimpleNamespace(serializer=JSONSerializer())
+        self.rejections = rejections
+        self.requests = []
+
+    def bulk(self, body, **kwargs):
+        self.requests.append(body)
+        if self.rejections:
+            self.rejections -= 1
+            raise TransportError(429, "es_rejected_execution_exception")
+        actions = [line for line in map(json.loads, body.splitlines()) if "index" in line]
+        return {"errors": False, "items": [{"index": {**action["index"], "status": 201}} for action in actions]}
+
+
+@pytest.fixture
+def fake_client():
+    tokens = []
+
+    def use(client):
+        tokens.append(os_client.set(client))
+        return client
+
+    yield use
+    for token in reversed(tokens):
+        os_client.reset(token)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    result = []
+    monkeypatch.setattr(opensearchpy.helpers.actions.time, "sleep", result.append)
+    return result
+
+
+def make_entries(count):
+    return [IndexEntry(id=str(i), entry={"name": "x" * 100}) for i in range(count)]
+
+
+def test_rejected_chunk_is_retried_with_backoff(fake_client, sleeps, monkeypatch):
+    monkeypatch.setattr(karp_config, "INDEX_BULK_MAX_RETRIES", 3)
+    client = fake_client(FakeOpenSearch(rejections=2))
+
+    ids = list(indices.add_entries_gen("places", make_entries(3), chunk_size=10))
+
+    assert ids == ["0", "1", "2"]
+    assert len(client.requests) == 3
+    # exponential backoff
+    assert sleeps == [2, 4]
+
+
+def test_rejected_chunk_fails_after_max_retries(fake_client, sleeps, monkeypatch):
+    monkeypatch.setattr(karp_config, "INDEX_BULK_MAX_RETRIES", 1)
+    fake_client(FakeOpenSearch(rejections=2))
+
+    with pytest.raises(TransportError):
+        list(indices.add_entries_gen("places", make_entries(3), chunk_size=10))
+    assert sleeps == [2]
+
+
+def test_max_chunk_bytes_splits_chunks(fake_client):
+    client = fake_client(FakeOpenSearch())
+
+    ids = list(indices.add_entries_gen("places", make_entries(10), chunk_size=10, max_chunk_bytes=500))
+
+    assert ids == [str(i) for i in range(10)]
+    assert len(client.requests) > 1
+    assert all(len(body.encode()) <= 500 for body in client.requests)
@@ -0,0 +1,131 @@
+"""Differential tests of KarpQueryFastParser against the generated KarpQueryParser."""
+
+import random
+import time
+
+import pytest
+from tatsu import exceptions as tatsu_exc
+
+from karp.search.domain.query_dsl.karp_query_fast_parser import KarpQueryFastParser
+from karp.search.domain.query_dsl.karp_query_model import KarpQueryModelBuilderSemantics, ModelBase
+from karp.search.domain.query_dsl.karp_query_parser import KarpQueryParser
+
+OPS = [
+    "exists",
+    "missing",
+    "freetext",
+    "contains",
+    "endswith",
+    "regexp",
+    "startswith",
+    "equals",
+    "gt",
+    "gte",
+    "lt",
+    "lte",
+]
+FIELDS = ["baseform", "pos", "infT.wf", "_last_modified", "a b", "*", "equalsx", "and", "not", "ö"]
+VALUES = ["katt", "12", "0", "a b", "12x", '"quoted"', '"with \\" quote"', '"a||b"', '"(x)"', '""', " 3", "٣"]
+NOISE = ["|", "||", "(", ")", '"', " ", "\n", "\\", "and", "or", "not", "gte", "1", "x"]
+
+
+@pytest.fixture(scope="module")
+def parsers():
+    return KarpQueryFastParser(), KarpQueryParser(semantics=KarpQueryModelBuilderSemantics())
+
+
+def dump(value):
+    """A comparable representation of a parse result."""
+    if isinstance(value, ModelBase):
+        ast = value.ast
+        if isinstance(ast, dict):
+            return type(value).__name__, {key: dump(item) for key, item in ast.items() if key != "parseinfo"}
+        return type(value).__name__, dump(ast)
+    if isinstance(value, list):
+        return [dump(item) for item in value]
+    return type(value).__name__, value
+
+
+def parse(parser, q):
+    try:
+        return dump(parser.parse(q))
+    except tatsu_exc.FailedParse:
+        return "error"
+
+
+def random_query(rng, depth=0):
+    kind = rng.randrange(4 if depth < 3 else 1)
+    if kind == 0:
+        op = rng.choice(OPS)
+        if op in ("exists", "missing"):
+            return f"{op}|{rng.choice(FIELDS)}"
+        if op == "freetext":
+            return f"freetext|{rng.choice(VALUES)}"
+        return f"{op}|{rng.choice(FIELDS)}|{rng.choice(VALUES)}"
+    if kind == 3:
+        return f"{rng.choice(FIELDS)}({random_query(rng, depth + 1)})"
+    op = ["and", "or", "not"][kind - 1]
+    return f"{op}({'||'.join(random_query(rng, depth + 1) for _ in range(rng.randrange(3)))})"
+
+
+def mutate(rng, q):
+    for _ in range(rng.randrange(1, 4)):
+        pos = rng.randrange(len(q) + 1)
+        action = rng.randrange(3)
+        if action == 0:
+            q = q[:pos] + rng.choice(NOISE) + q[pos:]
+        elif action == 1:
+            q = q[:pos] + q[pos + 1 :]
+        else:
+            q = q[:pos] + " " + q[pos:]
+    return q
+
+
+@pytest.mark.parametrize(
+    "q",
+    [
+        "equals|baseform|katt",
+        "equals|a|12",
+        "equals|a|12x",
+        'equals|a|"12"',
+        "gte|_last_modified|1700000000",
+        "gt|a|1",
+        "and()",
+        "or(exists|x||missing|y)",
+        'and(exists|x||freetext|"a \\"b\\" c")',
+        "not(equals|pos|nn||equals|pos|vb)",
+        "infT(and(equals|msd|sg indef nom||startswith|wf|katt))",
+        " equals | a |b ",
+        "equals|a|12\n",
+        "not()",
+        "and(exists|x||)",
+        "equals|a",
+        "",
+    ],
+)
+def test_same_result_as_generated_parser(parsers, q):
+    fast, generated = parsers
+    assert parse(fast, q) == parse(generated, q)
+
+
+def test_fuzzed_queries(parsers):
+    fast, generated = parsers
+    rng = random.Random(1234)  # noqa: S311
+    for _ in range(3000):
+        q = random_query(rng)
+        if rng.random() < 0.5:
+            q = mutate(rng, q)
+        expected = parse(generated, q)
+        if expected == "error":
+            # the TatSu runtime rejects some valid queries, such as
+            # "and(r(*(endswith|d|0))||exists|*)", which the fast parser accepts
+            continue
+        assert parse(fast, q) == expected, q
+
+
+@pytest.mark.parametrize("q", ["and(" * 20 + "exists|x", "not(" * 20 + "or(" * 20 + "x", "a(" * 30 + "exists|x"])
+def test_nested_invalid_queries_fail_fast(parsers, q):
+    fast, _generated = parsers
+    start = time.perf_counter()
+    assert parse(fast, q) == "error"
+    assert time.perf_counter() - start < 1
@@ -0,0 +1,32 @@
+import pytest
+from tatsu import exceptions as tatsu_exc
+
+from karp.search.infrastructure.opensearch.search_service import parse_query
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    parse_query.cache_clear()
+    yield
+    parse_query.cache_clear()
+
+
+def test_parsed_query_is_cached():
+    model = parse_query("equals|baseform|katt")
+    assert parse_query("equals|baseform|katt") is model
+
+    info = parse_query.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
+
+
+def test_different_queries_are_parsed_separately():
+    assert parse_query("equals|baseform|katt") is not parse_query("equals|baseform|hund")
+    assert parse_query.cache_info().misses == 2
+
+
+def test_failed_parse_is_not_cached():
+    for _ in range(2):
+        with pytest.raises(tatsu_exc.FailedParse):
+            parse_query("equals|baseform")
+    info = parse_query.cache_info()
+    assert (info.hits, info.misses, info.currsize) == (0, 2, 0)
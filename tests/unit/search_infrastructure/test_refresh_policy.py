@@ -0,0 +1,33 @@
+import pydantic
+import pytest
+
+from karp.lex.domain.value_objects import ResourceConfig
+from karp.main import config as karp_config
+from karp.search.infrastructure.opensearch import indices
+
+
+@pytest.mark.parametrize(
+    "policy, expected_interval",
+    [
+        ("immediate", -1),
+        ("none", -1),
+        ("wait_for", "1s"),
+        ("500ms", "500ms"),
+        ("5s", "5s"),
+    ],
+)
+def test_refresh_interval(policy: str, expected_interval):
+    config = ResourceConfig(resource_id="", config_str="", fields={}, refresh_policy=policy)
+    assert indices.refresh_policy(config) == policy
+    assert indices.refresh_interval(policy) == expected_interval
+
+
+def test_default_refresh_policy():
+    config = ResourceConfig(resource_id="", config_str="", fields={})
+    assert indices.refresh_policy(config) == karp_config.INDEX_REFRESH_POLICY
+
+
+@pytest.mark.parametrize("policy", ["sometimes", "500", "5 s", "wait-for"])
+def test_invalid_refresh_policy(policy: str):
+    with pytest.raises(pydantic.ValidationError):
+        ResourceConfig(resource_id="", config_str="", fields={}, refresh_policy=policy)